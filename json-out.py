@@ -50,12 +50,23 @@ Example:
     }
 """
 
+import collections
+import csv
+import gzip
+import httplib
+import itertools
 import optparse
-from itertools import izip
 import json
+import math
+from multiprocessing.pool import ThreadPool
+import Queue
 import re
+import shlex
 import subprocess
 import sys
+import threading
+import time
+import urlparse
 
 
 request_response_re = re.compile(r'(REQ|RESP|RESP BODY):(.+)')
@@ -68,10 +79,31 @@ params_re = re.compile(r"-d \'([^\']+)\'")
 response_status_re = re.compile(r"\s*\[(\d+)\]\s+")
 # response_info_re = re.compile(r"({[^}]+})(.*)")
 
+log_time_re = re.compile(r'\d{4}-\d\d-\d\d[ T]\d\d:\d\d:\d\d(?:[.,]\d+)?')
+# Request ID, or else process ID (after the timestamp), in a log record
+# header
+log_request_id_re = re.compile(r'\[(req-[0-9a-fA-F-]+)')
+log_pid_re = re.compile(r'^\S+ \S+ (\d+) ')
+# IDs in URLs (UUIDs, hex IDs, and numbers)
+url_id_re = re.compile(r'/(?:[0-9a-fA-F]{8}(?:-[0-9a-fA-F]{4}){3}-'
+                       r'[0-9a-fA-F]{12}|[0-9a-fA-F]{32}|\d+)(?=[/.]|$)')
+
+LOG_CHUNK_SIZE = 64 * 1024
+PERCENTILES = (50, 90, 99)
+
+api_stats = None
+
+
+Exchange = collections.namedtuple('Exchange',
+                                  'request response body sent received')
+
 
 class InvalidInputException(Exception):
     pass
 
+class InvalidManifestException(Exception):
+    pass
+
 def strip_trailing_whitespace(multi_string):
     stripped = [m.rstrip() for m in multi_string.split('\n')]
     return '\n'.join(stripped)
@@ -90,7 +122,7 @@ def extract_request(info):
         if not opts.show_auth and 'X-Auth-Token' in headers:
             del headers['X-Auth-Token']
         filtered_headers = ["%s: %s" % (k, headers_dict[k])
-                            for k in headers]
+                            for k in headers if k in headers_dict]
 
         req_params = params_re.search(info)
         if req_params:
@@ -102,6 +134,15 @@ def extract_request(info):
     else:
         raise InvalidInputException("Unable to parse request: %s" % info)
 
+def parse_request(info):
+    """Return method, URL, headers, and body of request, for replaying it."""
+    m = request_info_re.search(info)
+    if not m:
+        raise InvalidInputException("Unable to parse request: %s" % info)
+    req_params = params_re.search(info)
+    return (m.group(1), m.group(2), dict(headers_re.findall(info)),
+            req_params.group(1) if req_params else None)
+
 def extract_response_status(info):
     m = response_status_re.search(info)
     if m:
@@ -117,60 +158,358 @@ def extract_response(info):
     else:
         return "[None]"
 
-def print_info_from_req_resp(raw_list):
-    print "\nJSON"
+def print_info_from_req_resp(exchanges, output_file=sys.stdout,
+                             filename=None):
+    """Print each request and its response, returning the number printed.
+
+    The exchanges can be a list, or a generator (as with --stream), in
+    which case each is printed as soon as it has been read. If a filename
+    prefix is given, the JSON is also saved to files. Exchanges with
+    missing or invalid parts are reported on stderr, and skipped.
+    """
+    print >>output_file, "\nJSON"
     instance = 0
-    for request, response, response_body in izip(raw_list[::3], raw_list[1::3],
-                                                 raw_list[2::3]):
-        operation, info = request
-        if operation != 'REQ':
-            raise InvalidInputException("Missing expected request")
-        
-        request_type, url, headers, request_json = extract_request(info)
-        if not opts.show_auth and url.endswith('v2.0'):
-            continue # Don't care about authentication request/response
-        
-        operation, info = response
-        if operation != 'RESP':
-            raise InvalidInputException("Missing expected response")
-        response_status = extract_response_status(info)
-
-        operation, info = response_body
-        if operation != 'RESP BODY':
-            raise InvalidInputException("Missing expected response body")
-        response_json = extract_response(info)
-
-        print "REQUEST\n%s %s" % (request_type, url)
-        print '\n'.join(headers)
+    count = 0
+    for exchange in exchanges:
+        if exchange.request is None:
+            print >>sys.stderr, "Skipping response without request: %s" % (
+                (exchange.response or exchange.body).strip())
+            continue
+        try:
+            request_type, url, headers, request_json = extract_request(
+                exchange.request)
+            if not opts.show_auth and url.endswith('v2.0'):
+                continue # Don't care about authentication request/response
+            if exchange.response is None or exchange.body is None:
+                raise InvalidInputException(
+                    "Missing response for: %s %s" % (request_type, url))
+            response_status = extract_response_status(exchange.response)
+            try:
+                response_json = extract_response(exchange.body)
+            except ValueError as e:
+                raise InvalidInputException(
+                    "Invalid response for: %s %s (%s)" % (request_type, url,
+                                                          e))
+        except (InvalidInputException, ValueError) as e:
+            print >>sys.stderr, "Skipping request: %s" % e
+            continue
+
+        print >>output_file, "REQUEST\n%s %s" % (request_type, url)
+        print >>output_file, '\n'.join(headers)
+        number = str(instance) if instance > 0 else ""
         if request_json:
-            print '\n%s\n\n' % request_json
-            if opts.filename:
-                name = "%s-req%s.json" % (opts.filename,
-                                          str(instance) if instance > 0 else "")
+            print >>output_file, '\n%s\n\n' % request_json
+            if filename:
+                name = "%s-req%s.json" % (filename, number)
                 with open(name, "w") as f:
                     f.write(request_json)
                     f.write('\n')
-        print '\nRESPONSE (%s)\n%s\n\n' % (response_status, response_json)
-        if opts.filename:
-            name = "%s-res%s.json" % (opts.filename,
-                                      str(instance) if instance > 0 else "")
+        print >>output_file, '\nRESPONSE (%s)\n%s\n\n' % (
+            response_status, response_json)
+        output_file.flush()
+        count += 1
+        if filename:
+            name = "%s-res%s.json" % (filename, number)
             with open(name, "w") as f:
                 f.write(response_json)
                 f.write('\n')
             instance += 1
-        
-        
+    return count
 
-def find_requests_and_responses(lines):
-    return request_response_re.findall(lines)
 
 def find_errors(lines):
     return errors_re.findall(lines)
 
-def collect_output_from_file(filename):
-    with open(filename) as f:
-        contents = f.read()
-    return contents
+def gen_requests_and_responses(lines, errors):
+    """Yield each request/response exchange, as the lines are read.
+
+    Errors found are appended to the list provided. If showing debug
+    output, the lines are echoed as they are read.
+    """
+    parser = exchange_parser()
+    for line in lines:
+        if opts.show_debug_output:
+            sys.stdout.write(line)
+        errors.extend(find_errors(line))
+        for exchange in parser.parse(line, time.time()):
+            yield exchange
+    for exchange in parser.finish():
+        yield exchange
+
+def url_template(url):
+    """Path of URL, with IDs replaced, so requests can be grouped."""
+    return url_id_re.sub('/{id}', urlparse.urlsplit(url).path)
+
+def parse_log_time(timestamp):
+    """Seconds since the epoch, for a log timestamp."""
+    seconds = time.mktime(time.strptime(timestamp[:19].replace('T', ' '),
+                                        '%Y-%m-%d %H:%M:%S'))
+    return seconds + float('0.' + (timestamp[20:] or '0'))
+
+def percentile(ordered, percent):
+    """Nearest rank percentile of a sorted list."""
+    rank = int(math.ceil(percent / 100.0 * len(ordered)))
+    return ordered[max(rank, 1) - 1]
+
+class ApiStats(object):
+    """Latency and payload sizes of requests, by method and URL template.
+
+    Requests are added by an ExchangeParser for each command or log, and
+    may be added from several threads (in batch mode).
+    """
+
+    def __init__(self):
+        self.samples = collections.defaultdict(list)
+        self.lock = threading.Lock()
+
+    def add(self, method, url, status, latency, request_size,
+            response_size):
+        with self.lock:
+            self.samples[(method, url_template(url))].append(
+                (latency, request_size, response_size, status))
+
+    def add_exchange(self, exchange):
+        """Add a request, if it has a response (which is needed to time it)."""
+        if exchange.request is None or exchange.response is None:
+            return
+        m = request_info_re.search(exchange.request)
+        if not m:
+            return
+        params = params_re.search(exchange.request)
+        status = response_status_re.search(exchange.response)
+        if exchange.sent is None or exchange.received is None:
+            latency = None
+        else:
+            latency = exchange.received - exchange.sent
+        self.add(m.group(1), m.group(2), status and status.group(1), latency,
+                 len(params.group(1)) if params else 0,
+                 len(exchange.body.strip()) if exchange.body else 0)
+
+    def summary(self):
+        """Statistics for each endpoint, ordered by URL and method.
+
+        Latencies are in milliseconds, and are only available for requests
+        that could be timed.
+        """
+        endpoints = []
+        for (method, url), samples in sorted(self.samples.items(),
+                                             key=lambda i: (i[0][1], i[0][0])):
+            latencies = sorted(s[0] * 1000 for s in samples
+                               if s[0] is not None)
+            statuses = collections.Counter(s[3] for s in samples)
+            endpoint = {
+                'method': method, 'url': url, 'count': len(samples),
+                'errors': sum(n for status, n in statuses.items()
+                              if not status or int(status) >= 400),
+                'status': dict(statuses),
+                'request_bytes': {
+                    'mean': sum(s[1] for s in samples) / len(samples),
+                    'max': max(s[1] for s in samples)},
+                'response_bytes': {
+                    'mean': sum(s[2] for s in samples) / len(samples),
+                    'max': max(s[2] for s in samples)},
+                'latency_ms': None}
+            if latencies:
+                latency = {'mean': sum(latencies) / len(latencies),
+                           'max': latencies[-1]}
+                for percent in PERCENTILES:
+                    latency['p%d' % percent] = percentile(latencies, percent)
+                endpoint['latency_ms'] = latency
+            endpoints.append(endpoint)
+        return endpoints
+
+class ExchangeParser(object):
+    """Single pass parser of debug output, yielding each exchange.
+
+    Output is parsed in pieces (lines, or chunks of lines), in order. The
+    operations are correlated using the request ID (or else, process ID)
+    in the log record header they are part of, so requests from several
+    threads or processes may be interleaved. Pieces may be missing, and an
+    exchange with missing parts (as None) is yielded, once another
+    operation shows it is incomplete, or at the end of the output. Only
+    the incomplete exchanges are held, so memory use is constant.
+
+    Each exchange is timed using the log timestamps, if the output has
+    them, or else by the time the piece of output was read (from a
+    command). If stats are provided, the exchanges are recorded in them.
+    """
+
+    def __init__(self, stats=None):
+        self.stats = stats
+        self.timestamp = None
+        self.logged = None
+        self.key = None
+        self.pending = collections.OrderedDict()
+
+    def log_time(self):
+        if self.logged is None:
+            self.logged = parse_log_time(self.timestamp)
+        return self.logged
+
+    def update_context(self, text, start, end):
+        """Use the last log record header in text[start:end], if any.
+
+        A header is a line starting with a timestamp. The text is searched
+        backwards, a line at a time, as the header is usually on the line
+        of (or just before) the operation.
+        """
+        while True:
+            newline = text.rfind('\n', start, end)
+            line_start = newline + 1 if newline >= 0 else 0
+            m = log_time_re.match(text, line_start)
+            if m:
+                if m.group() != self.timestamp:
+                    self.timestamp = m.group()
+                    self.logged = None
+                line_end = text.find('\n', line_start, end)
+                header = text[line_start:line_end if line_end >= 0 else end]
+                context = (log_request_id_re.search(header) or
+                           log_pid_re.match(header))
+                self.key = context and context.group(1)
+                return
+            if newline <= start:
+                return
+            end = newline
+
+    def parse(self, text, when=None):
+        searched = 0
+        for m in request_response_re.finditer(text):
+            # Only search the text since the previous operation
+            self.update_context(text, searched, m.start())
+            searched = m.end()
+            if self.timestamp:
+                when = self.log_time()
+            for exchange in self.add(m.group(1), m.group(2), when):
+                yield exchange
+        self.update_context(text, searched, len(text))
+
+    def add(self, operation, info, when):
+        """Yield any exchanges completed (or shown incomplete) by operation.
+
+        Pending exchanges are [request, response, sent, received].
+        """
+        pending = self.pending.get(self.key)
+        if operation == 'REQ':
+            if pending:
+                yield self.complete(self.key, None)
+            self.pending[self.key] = [info, None, when, None]
+        elif operation == 'RESP':
+            if pending and pending[1] is None:
+                pending[1] = info
+                pending[3] = when
+            else:
+                if pending:
+                    yield self.complete(self.key, None)
+                self.pending[self.key] = [None, info, None, when]
+        elif pending:
+            yield self.complete(self.key, info)
+        else:
+            yield self.record(Exchange(None, None, info, None, None))
+
+    def complete(self, key, body):
+        request, response, sent, received = self.pending.pop(key)
+        return self.record(Exchange(request, response, body, sent, received))
+
+    def record(self, exchange):
+        if self.stats is not None:
+            self.stats.add_exchange(exchange)
+        return exchange
+
+    def finish(self):
+        """Yield the exchanges that are still incomplete, at end of output."""
+        while self.pending:
+            yield self.complete(next(iter(self.pending)), None)
+
+def exchange_parser():
+    """Return parser for output, which records exchanges if timing."""
+    return ExchangeParser(api_stats)
+
+def parse_exchanges(text, when=None):
+    """Yield each exchange in output that has been read in its entirety."""
+    parser = exchange_parser()
+    for exchange in parser.parse(text, when):
+        yield exchange
+    for exchange in parser.finish():
+        yield exchange
+
+def format_ms(value):
+    return '-' if value is None else '%.1f' % value
+
+def print_api_stats(endpoints, output_file=sys.stdout):
+    print >>output_file, "\nAPI TIMING (ms) AND SIZES (bytes)"
+    if not endpoints:
+        print >>output_file, "No requests found"
+        return
+    width = max(len(e['url']) for e in endpoints)
+    headings = ['COUNT', 'ERRORS', 'MEAN'] + ['P%d' % p for p in PERCENTILES]
+    headings += ['MAX', 'REQ', 'RESP']
+    print >>output_file, "%-6s %-*s %s" % (
+        'METHOD', width, 'URL', ' '.join('%8s' % h for h in headings))
+    for e in endpoints:
+        latency = e['latency_ms'] or {}
+        columns = [e['count'], e['errors'], format_ms(latency.get('mean'))]
+        columns += [format_ms(latency.get('p%d' % p)) for p in PERCENTILES]
+        columns += [format_ms(latency.get('max')),
+                    e['request_bytes']['mean'], e['response_bytes']['mean']]
+        print >>output_file, "%-6s %-*s %s" % (
+            e['method'], width, e['url'],
+            ' '.join('%8s' % c for c in columns))
+
+def write_api_report(endpoints, filename):
+    """Write the API stats as CSV, if the file has a .csv suffix, else JSON."""
+    with open(filename, 'w') as f:
+        if not filename.endswith('.csv'):
+            json.dump(endpoints, f, indent=4, sort_keys=True)
+            f.write('\n')
+            return
+        writer = csv.writer(f)
+        latency_columns = ['mean'] + ['p%d' % p for p in PERCENTILES]
+        latency_columns.append('max')
+        writer.writerow(['method', 'url', 'count', 'errors'] +
+                        ['latency_%s_ms' % c for c in latency_columns] +
+                        ['request_bytes_mean', 'request_bytes_max',
+                         'response_bytes_mean', 'response_bytes_max'])
+        for e in endpoints:
+            latency = e['latency_ms'] or {}
+            writer.writerow(
+                [e['method'], e['url'], e['count'], e['errors']] +
+                [latency.get(c, '') for c in latency_columns] +
+                [e['request_bytes']['mean'], e['request_bytes']['max'],
+                 e['response_bytes']['mean'], e['response_bytes']['max']])
+
+def gen_output_from_file(filename, chunk_size=LOG_CHUNK_SIZE):
+    """Yield contents of a log file, in chunks that end with a complete line.
+
+    The file is not read into memory, so logs of any size can be processed.
+    Gzipped logs (.gz) are decompressed as they are read.
+    """
+    opener = gzip.open if filename.endswith('.gz') else open
+    with opener(filename, 'rb') as f:
+        partial = ''
+        for chunk in iter(lambda: f.read(chunk_size), ''):
+            chunk = partial + chunk
+            end = chunk.rfind('\n') + 1
+            partial = chunk[end:]
+            if end:
+                yield chunk[:end]
+        if partial:
+            yield partial
+
+def gen_requests_and_responses_from_logs(filenames):
+    """Yield each request/response exchange found in the log files.
+
+    Each log is parsed in chunks that end with a complete line, so the
+    operations found are the same as when parsing the entire log, as an
+    operation never spans lines.
+    """
+    for filename in filenames:
+        print >>sys.stderr, "Processing File:", filename
+        parser = exchange_parser()
+        for chunk in gen_output_from_file(filename):
+            for exchange in parser.parse(chunk):
+                yield exchange
+        for exchange in parser.finish():
+            yield exchange
 
 def collect_output_from_command(cmd):
     """Run command with verbose and return only the stderr output.
@@ -194,6 +533,353 @@ def collect_output_from_command(cmd):
     else:
         return output, err_msgs
 
+def drain(pipe, output):
+    for line in iter(pipe.readline, ''):
+        output.append(line)
+    pipe.close()
+
+def stream_output_from_command(cmd, output):
+    """Run command with verbose and yield the stderr output, line by line.
+
+    Unlike collect_output_from_command(), the debug output can be processed
+    while the command is running. The stdout output is read by a thread
+    into the list provided, so that the command does not block on a full
+    pipe. That list is complete, once the stderr output has been consumed.
+    """
+    try:
+        p = subprocess.Popen(cmd, bufsize=-1,
+                             stdout=subprocess.PIPE,
+                             stderr=subprocess.PIPE)
+    except OSError as err:
+        print("Failed running '%s' (%d - %s)" %
+              (sys.argv, err.errno, err.strerror))
+        raise
+    reader = threading.Thread(target=drain, args=(p.stdout, output))
+    reader.daemon = True
+    reader.start()
+    for line in iter(p.stderr.readline, ''):
+        yield line
+    p.stderr.close()
+    reader.join()
+    p.wait()
+
+def collect_timed_output_from_command(cmd):
+    """Run command with verbose, returning output and the exchanges.
+
+    The debug output is read as the command runs, so that the time each
+    request and response is output can be recorded.
+    """
+    normal_output = []
+    debug_lines = []
+    exchanges = []
+    parser = exchange_parser()
+    for line in stream_output_from_command(cmd, normal_output):
+        debug_lines.append(line)
+        exchanges.extend(parser.parse(line, time.time()))
+    exchanges.extend(parser.finish())
+    return ''.join(normal_output), ''.join(debug_lines), exchanges
+
+def process_command_stream(cmd):
+    """Print request/response info while the command runs.
+
+    As the info has been printed by the time the command finishes, any
+    errors are reported at the end, instead of in place of the info, and
+    are returned.
+    """
+    normal_output = []
+    errors = []
+    if opts.show_debug_output:
+        print "\nDEBUG OUTPUT:\n"
+    debug_lines = stream_output_from_command(cmd, normal_output)
+    print_info_from_req_resp(gen_requests_and_responses(debug_lines, errors),
+                             filename=opts.filename)
+    if opts.show_output:
+        print "\nCOMMAND OUTPUT:\n"
+        print ''.join(normal_output)
+    if errors:
+        print "Command failed! Errors reported:"
+        print '\n'.join(errors)
+    return errors
+
+def process_command(cmd, output_file=sys.stdout, filename=None):
+    """Run command and print the request/response info.
+
+    Returns any errors reported by the command (in which case, they are
+    printed instead of the info), and the number of requests printed.
+    """
+    if api_stats is None:
+        normal_output, debug_lines = collect_output_from_command(cmd)
+        exchanges = parse_exchanges(debug_lines)
+    else:
+        normal_output, debug_lines, exchanges = (
+            collect_timed_output_from_command(cmd))
+    errors = find_errors(debug_lines)
+    if errors:
+        print >>output_file, "Command failed! Errors reported:"
+        print >>output_file, '\n'.join(errors)
+        return errors, 0
+
+    if opts.show_debug_output:
+        print >>output_file, "\nDEBUG OUTPUT:\n"
+        print >>output_file, debug_lines
+    if opts.show_output:
+        print >>output_file, "\nCOMMAND OUTPUT:\n"
+        print >>output_file, normal_output
+    return [], print_info_from_req_resp(exchanges, output_file, filename)
+
+class BatchJob(object):
+    """A command from a batch manifest, and the outcome of running it."""
+
+    def __init__(self, prefix, after, command):
+        self.prefix = prefix
+        self.after = after
+        self.command = command
+        self.status = 'pending'
+        self.elapsed = 0.0
+        self.requests = 0
+
+    def run(self):
+        """Run the command, writing the info to <prefix>.out.
+
+        The JSON is saved using the prefix, as with the -f option. Since
+        this runs in a worker thread, failures are recorded in the status,
+        rather than raised (as the pool would never return the job).
+        """
+        start = time.time()
+        try:
+            with open(self.prefix + '.out', 'w') as output_file:
+                errors, self.requests = process_command(
+                    self.command, output_file, self.prefix)
+            self.status = 'failed' if errors else 'ok'
+        except Exception as e:
+            self.status = 'failed (%s: %s)' % (e.__class__.__name__, e)
+        self.elapsed = time.time() - start
+        return self
+
+def read_manifest(filename):
+    """Read batch jobs from manifest, checking the dependencies.
+
+    Each line has the filename prefix for the command, the prefixes of any
+    commands that must be run before it, a double dash, and the command.
+    Blank lines and lines starting with # are ignored. For example:
+
+        router-create -- neutron --verbose router-create router1
+        router-show router-create -- neutron --verbose router-show router1
+    """
+    jobs = collections.OrderedDict()
+    with open(filename) as f:
+        for number, line in enumerate(f, 1):
+            if not line.strip() or line.lstrip().startswith('#'):
+                continue
+            fields = shlex.split(line)
+            if '--' not in fields or fields.index('--') == 0:
+                raise InvalidManifestException(
+                    "Line %d: expected 'PREFIX [AFTER...] -- COMMAND'" %
+                    number)
+            split = fields.index('--')
+            prefix, after, command = (fields[0], fields[1:split],
+                                      fields[split + 1:])
+            if not command:
+                raise InvalidManifestException("Line %d: no command" % number)
+            if prefix in jobs:
+                raise InvalidManifestException(
+                    "Line %d: duplicate prefix '%s'" % (number, prefix))
+            jobs[prefix] = BatchJob(prefix, after, command)
+    if not jobs:
+        raise InvalidManifestException("No commands found")
+    for job in jobs.values():
+        for dependency in job.after:
+            if dependency not in jobs:
+                raise InvalidManifestException(
+                    "'%s' is after unknown prefix '%s'" %
+                    (job.prefix, dependency))
+    # Remove jobs that could be run, until none are left (or a cycle is)
+    ordered = set()
+    remaining = list(jobs)
+    while remaining:
+        ready = [name for name in remaining
+                 if all(dep in ordered for dep in jobs[name].after)]
+        if not ready:
+            raise InvalidManifestException(
+                "Circular dependency among: %s" % ', '.join(remaining))
+        ordered.update(ready)
+        remaining = [name for name in remaining if name not in ordered]
+    return jobs.values()
+
+def run_batch(jobs, workers):
+    """Run the jobs with a pool of worker threads.
+
+    A job is started once all the jobs it is after have finished. If any
+    of those failed, the job is skipped. Jobs are otherwise started in
+    manifest order. The jobs must have been checked for circular
+    dependencies (by read_manifest).
+    """
+    pending = collections.OrderedDict((job.prefix, job) for job in jobs)
+    finished = {}
+    completed = Queue.Queue()
+    pool = ThreadPool(workers)
+    running = 0
+    while pending or running:
+        # Skipping a job may allow ones before it to be started or skipped
+        started = True
+        while started:
+            started = False
+            for prefix, job in pending.items():
+                if not all(dep in finished for dep in job.after):
+                    continue
+                del pending[prefix]
+                started = True
+                failed = [dep for dep in job.after
+                          if finished[dep].status != 'ok']
+                if failed:
+                    job.status = 'skipped (%s failed)' % ', '.join(failed)
+                    finished[prefix] = job
+                else:
+                    pool.apply_async(job.run, callback=completed.put)
+                    running += 1
+        if not running:
+            break
+        job = completed.get()
+        running -= 1
+        finished[job.prefix] = job
+        print "Finished %s: %s" % (job.prefix, job.status)
+    pool.close()
+    pool.join()
+
+class Replayer(object):
+    """Send captured requests to an API endpoint, from several threads.
+
+    Each worker thread has its own connection, which is kept open for the
+    requests it sends. The requests are sent in order (repeating them, if
+    more requests than were captured are to be sent), and the result of
+    each is added to the stats. Requests that fail without a response are
+    counted as errors (by the exception), and are not timed.
+    """
+
+    def __init__(self, target, requests, total, stats, token=None,
+                 timeout=30):
+        self.target = urlparse.urlsplit(target)
+        self.requests = requests
+        self.total = total
+        self.stats = stats
+        self.token = token
+        self.timeout = timeout
+        self.counter = itertools.count()
+        self.lock = threading.Lock()
+        self.latencies = []
+        self.failures = collections.Counter()
+
+    def connect(self):
+        if self.target.scheme == 'https':
+            connection_class = httplib.HTTPSConnection
+        else:
+            connection_class = httplib.HTTPConnection
+        return connection_class(self.target.hostname, self.target.port,
+                                timeout=self.timeout)
+
+    def next_request(self):
+        with self.lock:
+            index = next(self.counter)
+        if index >= self.total:
+            return None
+        return self.requests[index % len(self.requests)]
+
+    def send(self, connection, request):
+        """Send request, returning status and response body."""
+        method, url, headers, body = request
+        parts = urlparse.urlsplit(url)
+        path = parts.path + ('?' + parts.query if parts.query else '')
+        if self.token:
+            headers = dict(headers)
+            headers['X-Auth-Token'] = self.token
+        connection.request(method, path, body, headers)
+        response = connection.getresponse()
+        return str(response.status), response.read()
+
+    def worker(self):
+        connection = self.connect()
+        latencies = []
+        failures = collections.Counter()
+        request = self.next_request()
+        while request is not None:
+            method, url, headers, body = request
+            start = time.time()
+            try:
+                status, response_body = self.send(connection, request)
+                latency = time.time() - start
+                latencies.append(latency)
+            except Exception as e:
+                # Request failed, so use a new connection for the next one
+                connection.close()
+                connection = self.connect()
+                status, response_body, latency = None, '', None
+                failures['%s: %s' % (e.__class__.__name__, e)] += 1
+            self.stats.add(method, url, status, latency,
+                           len(body or ''), len(response_body))
+            request = self.next_request()
+        connection.close()
+        with self.lock:
+            self.latencies.extend(latencies)
+            self.failures.update(failures)
+
+    def run(self, workers):
+        """Send the requests, returning the elapsed time."""
+        start = time.time()
+        threads = [threading.Thread(target=self.worker)
+                   for _ in range(workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return time.time() - start
+
+def gen_captured_requests(exchanges):
+    """Yield each request in the exchanges, for replaying.
+
+    As when printing, authentication requests are skipped, unless showing
+    authentication messages.
+    """
+    for exchange in exchanges:
+        if exchange.request is None:
+            continue
+        try:
+            request = parse_request(exchange.request)
+        except InvalidInputException as e:
+            print >>sys.stderr, "Skipping request: %s" % e
+            continue
+        if opts.show_auth or not request[1].endswith('v2.0'):
+            yield request
+
+def print_replay_summary(replayer, elapsed, workers, output_file=sys.stdout):
+    latencies = sorted(latency * 1000 for latency in replayer.latencies)
+    failed = sum(replayer.failures.values())
+    sent = len(latencies) + failed
+    errors = sum(e['errors'] for e in replayer.stats.summary())
+    print >>output_file, "\nREPLAY SUMMARY"
+    print >>output_file, "Sent %d requests to %s in %.2f secs with %d " \
+        "workers (%.1f requests/sec)" % (
+            sent, replayer.target.geturl(), elapsed, workers,
+            sent / elapsed if elapsed else 0)
+    print >>output_file, "Errors: %d (%.1f%%), of which %d failed without " \
+        "a response" % (errors, 100.0 * errors / sent if sent else 0, failed)
+    for failure, count in replayer.failures.most_common():
+        print >>output_file, "    %d x %s" % (count, failure)
+    if latencies:
+        print >>output_file, "Latency (ms) of responses: mean %.1f, %s, " \
+            "max %.1f" % (sum(latencies) / len(latencies),
+                          ', '.join('p%d %.1f' % (p, percentile(latencies, p))
+                                    for p in PERCENTILES),
+                          latencies[-1])
+
+def print_batch_summary(jobs):
+    print "\nBATCH SUMMARY"
+    width = max([len(job.prefix) for job in jobs] or [0])
+    for job in jobs:
+        print "%-*s %8.2f secs %4d requests  %s" % (
+            width, job.prefix, job.elapsed, job.requests, job.status)
+    print "Total: %.2f secs of command time" % sum(job.elapsed
+                                                   for job in jobs)
+
 if __name__ == '__main__':
     usage = "usage: %prog [options] -- command to run with verbose flag enabled"
     
@@ -209,25 +895,89 @@ if __name__ == '__main__':
                       help='Show authentication messages and headers')
     parser.add_option('-f', "--filename", dest="filename", metavar="FILE",
                       help='Save JSON to file(s) with prefix specified')
+    parser.add_option('-s', "--stream", action='store_true', default=False,
+                      dest='stream',
+                      help='Show JSON for each request/response as the '
+                      'command runs, instead of when it completes')
+    parser.add_option('-b', "--batch", dest="batch", metavar="MANIFEST",
+                      help='Run the commands in manifest, saving info and '
+                      'JSON with the prefix for each command')
+    parser.add_option('-l', "--log", action='append', dest="logs",
+                      metavar="FILE",
+                      help='Show JSON from existing verbose output in log '
+                      'file, instead of running a command (may be repeated)')
+    parser.add_option('-w', "--workers", dest="workers", type='int',
+                      default=4,
+                      help='Commands to run at once in batch mode, or '
+                      'requests to send at once in replay mode '
+                      '(default %default)')
+    parser.add_option("--replay", dest="replay", metavar="URL",
+                      help='Send the requests in the log file(s) to the API '
+                      'endpoint URL (e.g. http://127.0.0.1:9696), and report '
+                      'the throughput and latency')
+    parser.add_option('-n', "--requests", dest="requests", type='int',
+                      help='Number of requests to send in replay mode '
+                      '(default is each request in the logs, once)')
+    parser.add_option("--token", dest="token",
+                      help='X-Auth-Token to use for requests in replay mode, '
+                      'instead of the ones in the logs')
+    parser.add_option('-t', "--timing", action='store_true', default=False,
+                      dest='timing',
+                      help='Report latency and payload sizes of requests, '
+                      'by method and URL')
+    parser.add_option('-r', "--report", dest="report", metavar="FILE",
+                      help='Save timing report to file, as CSV if it has a '
+                      '.csv suffix, else as JSON (implies -t)')
 
     opts,openstack_command = parser.parse_args()
+    if opts.replay and not opts.logs:
+        parser.error("Replay mode needs log file(s) of requests (-l)")
+    if opts.timing or opts.report:
+        api_stats = ApiStats()
 
-    if len(openstack_command) == 0:
-        print "No command provided to run...exiting.\n\n"
-        sys.exit(0)
-        
-    normal_output, debug_lines = collect_output_from_command(openstack_command)
-    operations = find_requests_and_responses(debug_lines)
-    errors = find_errors(debug_lines)
-    if errors:
-        print "Command failed! Errors reported:"
-        print '\n'.join(errors)
-        sys.exit(1)
+    if opts.replay:
+        captured = list(gen_captured_requests(
+            gen_requests_and_responses_from_logs(opts.logs)))
+        if not captured:
+            print "No requests found to replay"
+            sys.exit(1)
+        # Stats are for the replayed requests, not the captured ones
+        api_stats = ApiStats()
+        replayer = Replayer(opts.replay, captured,
+                            opts.requests or len(captured), api_stats,
+                            opts.token)
+        elapsed = replayer.run(opts.workers)
+        print_replay_summary(replayer, elapsed, opts.workers)
+        status = 0
+    elif opts.batch:
+        try:
+            jobs = read_manifest(opts.batch)
+            run_batch(jobs, opts.workers)
+        except InvalidManifestException as e:
+            print "Invalid manifest %s: %s" % (opts.batch, e)
+            sys.exit(2)
+        print_batch_summary(jobs)
+        status = 0 if all(job.status == 'ok' for job in jobs) else 1
+    elif opts.logs:
+        print_info_from_req_resp(
+            gen_requests_and_responses_from_logs(opts.logs),
+            filename=opts.filename)
+        status = 0
+    else:
+        if len(openstack_command) == 0:
+            print "No command provided to run...exiting.\n\n"
+            sys.exit(0)
 
-    if opts.show_debug_output:
-        print "\nDEBUG OUTPUT:\n"
-        print debug_lines
-    if opts.show_output:
-        print "\nCOMMAND OUTPUT:\n"
-        print normal_output
-    print_info_from_req_resp(operations)
+        if opts.stream:
+            errors = process_command_stream(openstack_command)
+        else:
+            errors, _ = process_command(openstack_command,
+                                        filename=opts.filename)
+        status = 1 if errors else 0
+
+    if api_stats:
+        endpoints = api_stats.summary()
+        print_api_stats(endpoints)
+        if opts.report:
+            write_api_report(endpoints, opts.report)
+    sys.exit(status)
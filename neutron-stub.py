@@ -0,0 +1,470 @@
+# Copyright 2015 Paul Michali.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Stand-in Neutron/VPNaaS API server and client, for running json-out.py.
+
+The server keeps resources (networks, subnets, ports, routers, and the VPN
+resources) in memory, with a configurable latency for each request, and
+size of each resource. The client takes neutron CLI style commands and,
+with --verbose, outputs the requests and responses to stderr in the same
+format as the neutron client, so json-out.py can be run against it, without
+a devstack.
+
+Example:
+    $ python neutron-stub.py server --latency 20 --size 500 &
+    $ python json-out.py -- python neutron-stub.py --verbose \\
+          vpn-ikepolicy-create ikepolicy1
+"""
+
+from __future__ import print_function
+
+import argparse
+import collections
+import json
+import os
+import random
+import re
+import socket
+import sys
+import threading
+import time
+import uuid
+
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    import httplib
+    from urlparse import parse_qs, urlsplit
+    from urllib import urlencode
+except ImportError:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    import http.client as httplib
+    from urllib.parse import parse_qs, urlencode, urlsplit
+
+
+API_PREFIX = '/v2.0/'
+TENANT_ID = 'f600e82d8b324979bb412d5e655cf0ee'
+uuid_re = re.compile(r'^[0-9a-f]{8}(-[0-9a-f]{4}){3}-[0-9a-f]{12}$')
+
+# Command prefix, and collection path, resource name, and default fields
+RESOURCES = collections.OrderedDict([
+    ('net', ('networks', 'network', {
+        'admin_state_up': True, 'shared': False, 'status': 'ACTIVE',
+        'subnets': []})),
+    ('subnet', ('subnets', 'subnet', {
+        'network_id': None, 'ip_version': 4, 'cidr': '10.1.0.0/24',
+        'gateway_ip': '10.1.0.1', 'enable_dhcp': True,
+        'allocation_pools': [{'start': '10.1.0.2', 'end': '10.1.0.254'}]})),
+    ('port', ('ports', 'port', {
+        'network_id': None, 'admin_state_up': True, 'status': 'DOWN',
+        'mac_address': 'fa:16:3e:2f:3a:01', 'fixed_ips': [],
+        'device_id': '', 'device_owner': ''})),
+    ('router', ('routers', 'router', {
+        'admin_state_up': True, 'status': 'ACTIVE',
+        'external_gateway_info': None, 'routes': []})),
+    ('vpn-ikepolicy', ('vpn/ikepolicies', 'ikepolicy', {
+        'auth_algorithm': 'sha1', 'encryption_algorithm': 'aes-128',
+        'pfs': 'group5', 'phase1_negotiation_mode': 'main',
+        'ike_version': 'v1',
+        'lifetime': {'units': 'seconds', 'value': 3600}})),
+    ('vpn-ipsecpolicy', ('vpn/ipsecpolicies', 'ipsecpolicy', {
+        'transform_protocol': 'esp', 'encapsulation_mode': 'tunnel',
+        'auth_algorithm': 'sha1', 'encryption_algorithm': 'aes-128',
+        'pfs': 'group5',
+        'lifetime': {'units': 'seconds', 'value': 3600}})),
+    ('vpn-service', ('vpn/vpnservices', 'vpnservice', {
+        'router_id': None, 'subnet_id': None, 'admin_state_up': True,
+        'status': 'PENDING_CREATE'})),
+    ('ipsec-site-connection', (
+        'vpn/ipsec-site-connections', 'ipsec_site_connection', {
+            'peer_address': '172.24.4.233', 'peer_id': '172.24.4.233',
+            'peer_cidrs': ['10.2.0.0/24'], 'psk': 'secret', 'mtu': 1500,
+            'initiator': 'bi-directional', 'auth_mode': 'psk',
+            'route_mode': 'static', 'admin_state_up': True,
+            'status': 'PENDING_CREATE', 'vpnservice_id': None,
+            'ikepolicy_id': None, 'ipsecpolicy_id': None,
+            'dpd': {'action': 'hold', 'interval': 30, 'timeout': 120}})),
+])
+ACTIONS = ('list', 'show', 'create', 'update', 'delete')
+
+
+def select_fields(item, fields):
+    """Resource with only the fields requested (all, if none are)."""
+    if not fields:
+        return item
+    return dict((field, item[field]) for field in fields if field in item)
+
+
+def make_resource(resource, fields, size):
+    """Create resource with default fields, padding the description."""
+    _, _, defaults = RESOURCES[resource]
+    item = json.loads(json.dumps(defaults))
+    item.update({'id': str(uuid.uuid4()), 'tenant_id': TENANT_ID,
+                 'name': '', 'description': 'x' * size})
+    item.update(fields)
+    return item
+
+
+class StubStore(object):
+
+    """Resources of each collection, which may be used from many threads."""
+
+    def __init__(self, records=0, size=0):
+        self.size = size
+        self.lock = threading.Lock()
+        self.collections = {}
+        for resource, (collection, _, _) in RESOURCES.items():
+            items = collections.OrderedDict()
+            for i in range(records):
+                item = make_resource(resource,
+                                     {'name': '%s%d' % (resource, i)}, size)
+                items[item['id']] = item
+            self.collections[collection] = (resource, items)
+
+    def find(self, path):
+        """Return the collection, and resource ID (if any) for a URL path."""
+        if not path.startswith(API_PREFIX):
+            return None, None
+        path = path[len(API_PREFIX):]
+        if path.endswith('.json'):
+            path = path[:-len('.json')]
+        for collection in self.collections:
+            if path == collection:
+                return collection, None
+            if path.startswith(collection + '/'):
+                return collection, path[len(collection) + 1:]
+        return None, None
+
+
+class StubHandler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+    # Send each response with one write, so Nagle's algorithm doesn't
+    # delay the body of keep-alive responses.
+    wbufsize = -1
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+    def send_json(self, status, body=None):
+        data = json.dumps(body).encode() if body is not None else b''
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=UTF-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+        self.wfile.flush()
+
+    def send_error_json(self, status, error_type, message):
+        self.send_json(status, {'NeutronError': {
+            'type': error_type, 'message': message, 'detail': ''}})
+
+    def read_body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        if not length:
+            return None
+        return json.loads(self.rfile.read(length).decode())
+
+    def handle_request(self):
+        latency = self.server.latency + random.uniform(0, self.server.jitter)
+        if latency:
+            time.sleep(latency)
+        parts = urlsplit(self.path)
+        store = self.server.store
+        collection, item_id = store.find(parts.path)
+        if collection is None:
+            return self.send_error_json(404, 'HTTPNotFound',
+                                        'The resource could not be found.')
+        resource, items = store.collections[collection]
+        singular = RESOURCES[resource][1]
+        try:
+            body = self.read_body()
+        except ValueError:
+            return self.send_error_json(400, 'HTTPBadRequest',
+                                        'Request body is not valid JSON.')
+        query = parse_qs(parts.query)
+        fields = query.get('fields')
+        with store.lock:
+            if item_id is None:
+                if self.command == 'GET':
+                    names = query.get('name')
+                    matches = [select_fields(item, fields)
+                               for item in items.values()
+                               if not names or item['name'] in names]
+                    plural = collection.split('/')[-1].replace('-', '_')
+                    return self.send_json(200, {plural: matches})
+                if self.command == 'POST' and body and singular in body:
+                    item = make_resource(resource, body[singular],
+                                         store.size)
+                    items[item['id']] = item
+                    return self.send_json(201, {singular: item})
+            elif item_id not in items:
+                return self.send_error_json(
+                    404, '%sNotFound' % singular.title().replace('_', ''),
+                    '%s %s could not be found' % (singular, item_id))
+            elif self.command == 'GET':
+                return self.send_json(
+                    200, {singular: select_fields(items[item_id], fields)})
+            elif self.command == 'PUT' and body and singular in body:
+                items[item_id].update(body[singular])
+                return self.send_json(200, {singular: items[item_id]})
+            elif self.command == 'DELETE':
+                del items[item_id]
+                return self.send_json(204)
+        self.send_error_json(400, 'HTTPBadRequest',
+                             'Unsupported %s request.' % self.command)
+
+    do_GET = do_POST = do_PUT = do_DELETE = handle_request
+
+
+class StubServer(ThreadingMixIn, HTTPServer):
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def create_server(host, port, records=1, size=0, latency=0, jitter=0,
+                  verbose=False):
+    """Create server (latency and jitter are in milliseconds)."""
+    server = StubServer((host, port), StubHandler)
+    server.store = StubStore(records, size)
+    server.latency = latency / 1000.0
+    server.jitter = jitter / 1000.0
+    server.verbose = verbose
+    return server
+
+
+def run_server(args):
+    server = create_server(args.host, args.port, args.records, args.size,
+                           args.latency, args.jitter, args.verbose)
+    print("Stub Neutron API on http://%s:%d (latency %dms, jitter %dms, "
+          "%d records of %d bytes)" % (args.host, args.port, args.latency,
+                                       args.jitter, args.records, args.size),
+          file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
+
+
+class StubClientError(Exception):
+    pass
+
+
+class StubClient(object):
+
+    """Sends requests to the API, logging them like the neutron client.
+
+    With verbose, each request is output to stderr as a curl command, and
+    the response as its status and headers, and then its body, which is the
+    format that json-out.py parses. With timestamps, each is preceded by a
+    log record header with the time and process ID, as in OpenStack logs.
+    """
+
+    def __init__(self, url, token, verbose=False, timestamps=False):
+        self.url = url.rstrip('/')
+        parts = urlsplit(self.url)
+        self.connection = httplib.HTTPConnection(parts.hostname,
+                                                 parts.port or 80)
+        self.token = token
+        self.verbose = verbose
+        self.timestamps = timestamps
+
+    def log(self, message):
+        if not self.verbose:
+            return
+        if self.timestamps:
+            now = time.time()
+            header = "%s.%03d %d DEBUG neutronclient.client [-] " % (
+                time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(now)),
+                int(now * 1000) % 1000, os.getpid())
+        else:
+            header = "DEBUG: neutronclient.client "
+        sys.stderr.write("%s\n%s\n" % (header, message))
+        sys.stderr.flush()
+
+    def request(self, method, path, body=None):
+        url = self.url + API_PREFIX + path
+        headers = collections.OrderedDict([
+            ('User-Agent', 'python-neutronclient'),
+            ('Content-Type', 'application/json'),
+            ('Accept', 'application/json'),
+            ('X-Auth-Token', self.token)])
+        data = json.dumps(body) if body is not None else None
+        self.log("REQ: curl -i -X %s %s %s%s" % (
+            method, url,
+            ' '.join('-H "%s: %s"' % header for header in headers.items()),
+            " -d '%s'" % data if data else ''))
+        try:
+            self.connection.request(method, API_PREFIX + path, data, headers)
+            response = self.connection.getresponse()
+            content = response.read().decode()
+        except (httplib.HTTPException, socket.error) as e:
+            raise StubClientError("Unable to reach %s (%s)" % (self.url, e))
+        response_headers = dict((k.lower(), v)
+                                for k, v in response.getheaders())
+        response_headers['status'] = str(response.status)
+        self.log("RESP: [%d] %r\nRESP BODY: %s\n" % (
+            response.status, response_headers, content))
+        result = json.loads(content) if content else None
+        if response.status >= 400:
+            raise StubClientError(result['NeutronError']['message'])
+        return result
+
+    def find_id(self, collection, singular, name_or_id):
+        """Find the ID of resource, looking it up by name if needed."""
+        if uuid_re.match(name_or_id):
+            return name_or_id
+        plural = collection.split('/')[-1].replace('-', '_')
+        query = urlencode([('fields', 'id'), ('name', name_or_id)])
+        items = self.request('GET', '%s.json?%s' % (collection, query))
+        if not items[plural]:
+            raise StubClientError("Unable to find %s with name '%s'" %
+                                  (singular, name_or_id))
+        return items[plural][0]['id']
+
+
+def parse_command(command):
+    """Split a CLI command (e.g. vpn-ikepolicy-create) into its parts."""
+    resource, _, action = command.rpartition('-')
+    if resource not in RESOURCES or action not in ACTIONS:
+        raise StubClientError("Unknown command '%s'" % command)
+    return resource, action
+
+
+def parse_fields(extra):
+    """Fields from --name value options, with values as JSON if valid."""
+    fields = {}
+    while extra:
+        option = extra.pop(0)
+        if not option.startswith('--') or not extra:
+            raise StubClientError("Expected --FIELD VALUE, not '%s'" % option)
+        value = extra.pop(0)
+        try:
+            value = json.loads(value)
+        except ValueError:
+            pass
+        fields[option[2:].replace('-', '_')] = value
+    return fields
+
+
+def print_fields(item, output_file):
+    for key in sorted(item):
+        print("| %-25s | %s" % (key, json.dumps(item[key])),
+              file=output_file)
+
+
+def run_command(client, resource, action, target, fields, output_file):
+    collection, singular, _ = RESOURCES[resource]
+    if action == 'list':
+        plural = collection.split('/')[-1].replace('-', '_')
+        for item in client.request('GET', collection + '.json')[plural]:
+            print("| %s | %s |" % (item['id'], item['name']),
+                  file=output_file)
+        return
+    if action == 'create':
+        if target:
+            fields['name'] = target
+        result = client.request('POST', collection + '.json',
+                                {singular: fields})
+        print("Created a new %s:" % singular, file=output_file)
+        print_fields(result[singular], output_file)
+        return
+    if not target:
+        raise StubClientError("%s-%s needs a name or ID" % (resource, action))
+    item_id = client.find_id(collection, singular, target)
+    path = '%s/%s.json' % (collection, item_id)
+    if action == 'show':
+        print_fields(client.request('GET', path)[singular], output_file)
+    elif action == 'update':
+        client.request('PUT', path, {singular: fields})
+        print("Updated %s: %s" % (singular, target), file=output_file)
+    else:
+        client.request('DELETE', path)
+        print("Deleted %s: %s" % (singular, target), file=output_file)
+
+
+def create_parser():
+    commands = ', '.join('%s-%s' % (resource, ACTIONS[0])
+                         for resource in RESOURCES)
+    parser = argparse.ArgumentParser(
+        description='Stand-in Neutron API server ("server" command), or '
+        'client (neutron style commands, with list, show, create, update, '
+        'and delete for each resource: %s, ...)' % commands)
+    parser.add_argument('--verbose', action='store_true',
+                        help='Client: output requests and responses to '
+                        'stderr, like the neutron client. Server: log each '
+                        'request')
+    parser.add_argument('--os-url', dest='url',
+                        default=os.environ.get('OS_URL',
+                                               'http://127.0.0.1:9696'),
+                        help='Client: API endpoint (default $OS_URL, or '
+                        '%(default)s)')
+    parser.add_argument('--os-token', dest='token',
+                        default=os.environ.get('OS_TOKEN', 'stub-token'),
+                        help='Client: token to send (default $OS_TOKEN, or '
+                        '%(default)s)')
+    parser.add_argument('--timestamps', action='store_true',
+                        help='Client: put a timestamped log record header '
+                        'before each request and response, as in OpenStack '
+                        'logs')
+    parser.add_argument('--repeat', type=int, default=1,
+                        help='Client: times to run the command')
+    parser.add_argument('--host', default='127.0.0.1',
+                        help='Server: address to listen on')
+    parser.add_argument('--port', type=int, default=9696,
+                        help='Server: port to listen on')
+    parser.add_argument('--latency', type=int, default=0,
+                        help='Server: milliseconds to delay each request')
+    parser.add_argument('--jitter', type=int, default=0,
+                        help='Server: up to this many more milliseconds of '
+                        'random delay')
+    parser.add_argument('--size', type=int, default=0,
+                        help='Server: bytes of description in each resource, '
+                        'to set the size of responses')
+    parser.add_argument('--records', type=int, default=1,
+                        help='Server: resources of each type to start with, '
+                        'to set the size of lists')
+    parser.add_argument('command',
+                        help='"server", or command (e.g. router-list)')
+    parser.add_argument('target', nargs='?',
+                        help='Name for create, or name or ID of resource')
+    return parser
+
+
+if __name__ == '__main__':
+    parser = create_parser()
+    args, extra = parser.parse_known_args()
+    if args.command == 'server':
+        if extra or args.target:
+            parser.error("Unexpected arguments for server: %s" %
+                         ' '.join(extra + [args.target or '']))
+        run_server(args)
+        sys.exit(0)
+
+    try:
+        resource, action = parse_command(args.command)
+        fields = parse_fields(extra)
+        client = StubClient(args.url, args.token, args.verbose,
+                            args.timestamps)
+        for _ in range(args.repeat):
+            run_command(client, resource, action, args.target, dict(fields),
+                        sys.stdout)
+    except StubClientError as e:
+        sys.stderr.write("ERROR: %s\n" % e)
+        sys.exit(1)
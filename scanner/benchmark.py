@@ -0,0 +1,308 @@
+# Copyright 2015 Paul Michali.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Benchmarks for scanner.py, using a generated source tree.
+
+Creates a fake Neutron tree and a source tree that imports modules from it,
+in all the import styles that the scanner handles, and then times parsing,
+alias usage matching, module resolution, and complete runs of the scanner.
+Results are output as JSON, and can be compared to those of a previous run.
+
+Example:
+    $ python benchmark.py --files 2000 -o after.json --baseline before.json
+"""
+
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+import scanner
+
+
+IMPORT_STYLES = ('import', 'import_as', 'from', 'from_as', 'from_list',
+                 'multiline', 'multiline_as')
+
+
+def make_neutron_tree(base, num_packages, modules_per_package):
+    """Create a fake Neutron tree, returning the dotted module names."""
+    modules = []
+    for p in range(num_packages):
+        package_dir = os.path.join(base, 'neutron', 'pkg%d' % p)
+        os.makedirs(package_dir)
+        open(os.path.join(package_dir, '__init__.py'), 'w').close()
+        for m in range(modules_per_package):
+            with open(os.path.join(package_dir, 'mod%d.py' % m), 'w') as f:
+                f.write("def func():\n    pass\n")
+            modules.append('neutron.pkg%d.mod%d' % (p, m))
+    open(os.path.join(base, 'neutron', '__init__.py'), 'w').close()
+    return modules
+
+
+def make_import(style, module, alias):
+    """Create import statement in the style, returning it and its alias."""
+    package, name = module.rsplit('.', 1)
+    if style == 'import':
+        return "import %s\n" % module, name
+    if style == 'import_as':
+        return "import %s as %s\n" % (module, alias), alias
+    if style == 'from':
+        return "from %s import %s\n" % (package, name), name
+    if style == 'from_as':
+        return "from %s import %s as %s\n" % (package, name, alias), alias
+    if style == 'from_list':
+        return "from %s import %s, mod0\n" % (package, name), name
+    if style == 'multiline':
+        return "from %s import (\n    %s)\n" % (package, name), name
+    return "from %s import (\n    %s as %s)\n" % (package, name, alias), alias
+
+
+def make_source_file(name, modules, imports_per_file, lines_per_file,
+                     usage_density, styles, rng):
+    imports = []
+    aliases = []
+    for i, module in enumerate(rng.sample(modules, imports_per_file)):
+        statement, alias = make_import(rng.choice(styles), module,
+                                       'alias%d' % i)
+        imports.append(statement)
+        aliases.append(alias)
+    with open(name, 'w') as f:
+        f.write("import os\n")
+        f.writelines(imports)
+        f.write("\n\nclass Generated(object):\n\n    def method(self, x):\n")
+        for i in range(lines_per_file):
+            if rng.random() < usage_density:
+                f.write("        x = %s.attr%d(x, %s.CONST)\n" %
+                        (rng.choice(aliases), i % 50, rng.choice(aliases)))
+            else:
+                f.write("        x = os.path.join(x, 'plain%d')\n" % i)
+        f.write("        return x\n")
+
+
+def make_source_tree(root, modules, num_files, imports_per_file,
+                     lines_per_file, usage_density, plain_fraction,
+                     styles, rng):
+    """Create source files, some fraction of them without Neutron imports.
+
+    Files are spread over sub-directories of 50 files each.
+    """
+    names = []
+    for i in range(num_files):
+        directory = os.path.join(root, 'dir%d' % (i // 50))
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        name = os.path.join(directory, 'source%d.py' % i)
+        if rng.random() < plain_fraction:
+            make_source_file(name, modules, 0, lines_per_file, 0, styles,
+                             rng)
+        else:
+            make_source_file(name, modules, imports_per_file, lines_per_file,
+                             usage_density, styles, rng)
+        names.append(name)
+    return names
+
+
+def time_it(func, repeat):
+    """Run func repeatedly, returning the best and median time."""
+    times = []
+    for _ in range(repeat):
+        start = time.time()
+        func()
+        times.append(time.time() - start)
+    times.sort()
+    return {'best': times[0], 'median': times[len(times) // 2]}
+
+
+def bench_gen_parse(contents, repeat):
+    def parse():
+        for lines in contents:
+            for _ in scanner.gen_parse(lines):
+                pass
+    return time_it(parse, repeat)
+
+
+def bench_find_import_usage(contents, repeat):
+    parsed = []
+    for lines in contents:
+        source_scanner = scanner.SourceScanner('bench.py')
+        usage_lines = []
+        for is_import, content, alias in scanner.gen_parse(lines):
+            if is_import:
+                source_scanner.add_import(alias, content)
+            else:
+                usage_lines.append(content)
+        parsed.append((source_scanner, usage_lines))
+
+    def match():
+        for source_scanner, usage_lines in parsed:
+            for line in usage_lines:
+                source_scanner.find_import_usage(line)
+    return time_it(match, repeat)
+
+
+def bench_resolution(targets, repeat):
+    def resolve():
+        for target in targets:
+            scanner.NeutronModule(target)
+    return time_it(resolve, repeat)
+
+
+def bench_process_references(argv, repeat):
+    args = scanner.create_parser().parse_args(argv)
+    return time_it(lambda: scanner.process_references(args), repeat)
+
+
+def run_benchmarks(opts, work_dir):
+    rng = random.Random(opts.seed)
+    base = os.path.join(work_dir, 'neutron-tree')
+    root = os.path.join(work_dir, 'source')
+    modules = make_neutron_tree(base, opts.packages, opts.modules)
+    names = make_source_tree(root, modules, opts.files, opts.imports,
+                             opts.lines, opts.density, opts.plain,
+                             opts.styles.split(','), rng)
+    scanner.set_targets([('neutron', base)])
+    contents = []
+    for name in names:
+        with open(name) as f:
+            contents.append(f.readlines())
+    num_lines = sum(len(lines) for lines in contents)
+    targets = [content for lines in contents
+               for is_import, content, alias in scanner.gen_parse(lines)
+               if is_import]
+
+    results = {}
+
+    def record(name, timing, items, unit):
+        timing['items'] = items
+        timing['unit'] = unit
+        timing['per_sec'] = items / timing['best'] if timing['best'] else None
+        results[name] = timing
+        print("%-32s %8.3f secs %12.0f %s/sec" %
+              (name, timing['best'], timing['per_sec'] or 0, unit),
+              file=sys.stderr)
+
+    record('gen_parse', bench_gen_parse(contents, opts.repeat),
+           num_lines, 'lines')
+    scanner.neutron_index = None
+    record('resolution_filesystem', bench_resolution(targets, opts.repeat),
+           len(targets), 'imports')
+    record('index_build',
+           time_it(lambda: scanner.load_neutron_index(), opts.repeat),
+           len(modules), 'modules')
+    record('resolution_index', bench_resolution(targets, opts.repeat),
+           len(targets), 'imports')
+    record('find_import_usage', bench_find_import_usage(contents, opts.repeat),
+           num_lines, 'lines')
+
+    output = os.path.join(work_dir, 'scan-output')
+    runs = [('process_references', []),
+            ('process_references_ast', ['--engine', 'ast']),
+            ('process_references_prefilter', ['--prefilter'])]
+    if opts.jobs != 1:
+        runs.append(('process_references_jobs',
+                     ['--jobs', str(opts.jobs)]))
+    for name, extra_args in runs:
+        argv = [root, '-s', '-o', output] + extra_args
+        record(name, bench_process_references(argv, opts.repeat),
+               len(names), 'files')
+
+    return {
+        'python': platform.python_version(),
+        'parameters': {
+            'files': opts.files, 'imports': opts.imports,
+            'lines': opts.lines, 'density': opts.density,
+            'plain': opts.plain, 'styles': opts.styles,
+            'packages': opts.packages, 'modules': opts.modules,
+            'seed': opts.seed, 'repeat': opts.repeat, 'jobs': opts.jobs,
+        },
+        'results': results,
+    }
+
+
+def compare_to_baseline(report, baseline_file, output_file):
+    with open(baseline_file) as f:
+        baseline = json.load(f)
+    if baseline['parameters'] != report['parameters']:
+        print("Warning: baseline was run with different parameters",
+              file=output_file)
+    print("Speedup relative to", baseline_file, file=output_file)
+    for name, timing in sorted(report['results'].items()):
+        before = baseline['results'].get(name)
+        if before and timing['best']:
+            print("    %-32s %6.2fx" % (name, before['best'] / timing['best']),
+                  file=output_file)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark scanner.py')
+    parser.add_argument('--files', type=int, default=500,
+                        help='Number of source files to generate')
+    parser.add_argument('--imports', type=int, default=20,
+                        help='Neutron imports per source file')
+    parser.add_argument('--lines', type=int, default=200,
+                        help='Lines of code per source file')
+    parser.add_argument('--density', type=float, default=0.3,
+                        help='Fraction of lines that use imported aliases')
+    parser.add_argument('--plain', type=float, default=0.3,
+                        help='Fraction of files without Neutron imports')
+    parser.add_argument('--styles', default=','.join(IMPORT_STYLES),
+                        help='Comma separated import styles to use, from %s' %
+                        ', '.join(IMPORT_STYLES))
+    parser.add_argument('--packages', type=int, default=20,
+                        help='Packages in the fake Neutron tree')
+    parser.add_argument('--modules', type=int, default=20,
+                        help='Modules per package in the fake Neutron tree')
+    parser.add_argument('--seed', type=int, default=1,
+                        help='Random seed, for reproducible source trees')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='Times to run each benchmark (best is reported)')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='Also benchmark a run with this many processes')
+    parser.add_argument('-o', '--output',
+                        help='Write JSON results to file, instead of stdout')
+    parser.add_argument('--baseline',
+                        help='JSON results of an earlier run to compare to')
+    parser.add_argument('--keep', metavar='DIR',
+                        help='Generate the trees in DIR and keep them')
+    opts = parser.parse_args()
+    if opts.imports > opts.packages * opts.modules:
+        parser.error('More imports than modules in the fake Neutron tree')
+
+    if opts.keep:
+        work_dir = opts.keep
+        if not os.path.isdir(work_dir):
+            os.makedirs(work_dir)
+    else:
+        work_dir = tempfile.mkdtemp(prefix='scanner-bench-')
+    try:
+        report = run_benchmarks(opts, work_dir)
+    finally:
+        if not opts.keep:
+            shutil.rmtree(work_dir)
+
+    if opts.output:
+        with open(opts.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    else:
+        print(json.dumps(report, indent=2, sort_keys=True))
+    if opts.baseline:
+        compare_to_baseline(report, opts.baseline, sys.stderr)
@@ -17,10 +17,51 @@ from __future__ import print_function
 
 import argparse
 import collections
+import heapq
+import json
 import sys
 
+
+class SummaryNotSorted(Exception):
+
+    message = ("Summary '%(name)s' is not sorted by module path "
+               "('%(module)s' is after '%(previous)s')")
+
+    def __init__(self, **kwargs):
+        self.msg = self.message % kwargs
+        super(SummaryNotSorted, self).__init__(self.msg)
+
+
 def gather_references(a_file, references, output_file):
     print("Processing File:", a_file, file=output_file)
+    if a_file.endswith('.jsonl'):
+        gather_jsonl_references(a_file, references)
+        return
+    for module_path, refs in gen_text_modules(a_file):
+        if refs:
+            references[module_path].update(refs)
+
+
+def gather_jsonl_references(a_file, references):
+    """Load summary in JSON Lines format, as written by scanner.py.
+
+    Like text summaries, modules without any references are not included.
+    """
+    with open(a_file) as contents:
+        for line in contents:
+            record = json.loads(line)
+            if record['refs']:
+                references[record['module']].update(record['refs'])
+
+
+def gen_text_modules(a_file):
+    """Yield module path and references, for each module in text summary.
+
+    Modules are indented by four spaces, and their references by eight
+    (module paths, e.g. for a top level six.py, need not have a '/').
+    """
+    module_path = None
+    refs = set()
     with open(a_file) as contents:
         for line in contents:
             item = line.strip()
@@ -28,18 +69,93 @@ def gather_references(a_file, references, output_file):
                 continue
             if item.startswith('Summary'):
                 continue
-            if item.startswith('neutron/'):
+            if not line.startswith(' ' * 8):
+                if module_path is not None:
+                    yield module_path, refs
                 module_path = item
+                refs = set()
                 continue
-            references[module_path].add(item)
+            refs.add(item)
+    if module_path is not None:
+        yield module_path, refs
+
+
+def gen_jsonl_modules(a_file):
+    with open(a_file) as contents:
+        for line in contents:
+            record = json.loads(line)
+            yield record['module'], set(record['refs'])
+
+
+def gen_sorted_modules(a_file, index):
+    """Yield modules from a summary, checking that they are in order.
+
+    Each module path and references are tagged with the index of the
+    summary, so that entries from different summaries can be heap merged.
+    """
+    if a_file.endswith('.jsonl'):
+        modules = gen_jsonl_modules(a_file)
+    else:
+        modules = gen_text_modules(a_file)
+    previous = None
+    for module_path, refs in modules:
+        if previous is not None and module_path < previous:
+            raise SummaryNotSorted(name=a_file, module=module_path,
+                                   previous=previous)
+        previous = module_path
+        yield module_path, index, refs
+
+
+def gen_merged_references(summary_files, exclusions, output_file):
+    """K-way merge of summaries, yielding each module and its references.
+
+    Summaries are read in step, so that only the references of the
+    module currently being merged are held in memory. As with merging in
+    memory, excluded modules and modules without references are skipped.
+    """
+    summaries = []
+    for index, a_file in enumerate(summary_files):
+        print("Processing File:", a_file, file=output_file)
+        summaries.append(gen_sorted_modules(a_file, index))
+    current_path = None
+    current_refs = set()
+    for module_path, _, refs in heapq.merge(*summaries):
+        if module_path != current_path:
+            if current_refs and current_path not in exclusions:
+                yield current_path, current_refs
+            current_path = module_path
+            current_refs = set()
+        current_refs |= refs
+    if current_refs and current_path not in exclusions:
+        yield current_path, current_refs
+
+
+def print_references(module_references, output_file):
+    for module_path, refs in module_references:
+        print("    " + module_path, file=output_file)
+        for ref in sorted(refs, key=lambda s: s.lower()):
+            print("        " + ref, file=output_file)
+
+
+def write_jsonl_references(module_references, output_file):
+    for module_path, refs in module_references:
+        dotted_name = module_path
+        if dotted_name.endswith('.py'):
+            dotted_name = dotted_name[:-len('.py')]
+        dotted_name = dotted_name.replace('/', '.')
+        output_file.write(json.dumps({'module': module_path,
+                                      'dotted_name': dotted_name,
+                                      'refs': sorted(refs)},
+                                     sort_keys=True))
+        output_file.write('\n')
 
 
 def get_exclusions(exclusion_file):
     if exclusion_file is None:
-        return []
+        return set()
     with open(exclusion_file) as contents:
         exclusions = contents.readlines()
-    return [ex.strip() for ex in exclusions]
+    return set(ex.strip() for ex in exclusions)
 
 
 if __name__ == '__main__':
@@ -49,6 +165,11 @@ if __name__ == '__main__':
                         'already and should be excluded')
     parser.add_argument('-o', '--output', dest='output', action='store',
                         help='Redirect output to file specified')
+    parser.add_argument('--jsonl', dest='jsonl', action='store_true',
+                        help='Output merged summary in JSON Lines format')
+    parser.add_argument('--stream', dest='stream', action='store_true',
+                        help='Merge summaries (which must be sorted by module '
+                        'path) in step, using memory for one module at a time')
     parser.add_argument('summary_files', metavar='FILE', nargs='+',
                         help='Summary files to merge')
     args = parser.parse_args()
@@ -58,17 +179,24 @@ if __name__ == '__main__':
     else:
         output_file = sys.stdout
 
-    references = collections.defaultdict(set)
-    for a_file in args.summary_files:
-        gather_references(a_file, references, output_file)
-
+    # Keep JSON Lines output clean of progress messages
+    progress_file = sys.stderr if args.jsonl else output_file
     exclusions = get_exclusions(args.exclude)
-    trimmed_references = [(k,v) for k,v in references.items()
-                          if k not in exclusions]
+    if args.stream:
+        module_references = gen_merged_references(
+            args.summary_files, exclusions, progress_file)
+    else:
+        references = collections.defaultdict(set)
+        for a_file in args.summary_files:
+            gather_references(a_file, references, progress_file)
 
-    sorted_refs = collections.OrderedDict(
-        sorted(trimmed_references, key=lambda t: t[0]))
-    for module_path, refs in sorted_refs.iteritems():
-        print("    " + module_path, file=output_file)
-        for ref in sorted(refs, key=lambda s: s.lower()):
-            print("        " + ref, file=output_file)
+        trimmed_references = [(k,v) for k,v in references.items()
+                              if k not in exclusions]
+
+        sorted_refs = collections.OrderedDict(
+            sorted(trimmed_references, key=lambda t: t[0]))
+        module_references = sorted_refs.iteritems()
+    if args.jsonl:
+        write_jsonl_references(module_references, output_file)
+    else:
+        print_references(module_references, output_file)
@@ -0,0 +1,63 @@
+# Copyright 2015 Paul Michali.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Look up Neutron symbol usage, in the index built by scanner.py --db.
+
+Example:
+    $ python query.py -d refs.db --symbol neutron.common.rpc.get_client
+    /opt/stack/neutron-vpnaas/neutron_vpnaas/services/vpn/agent.py:42: ...
+"""
+
+from __future__ import print_function
+
+import argparse
+import os
+import sys
+
+import scanner
+
+
+def print_rows(rows, output_file):
+    for module, path, symbol, qualified, source, line in rows:
+        print("%s:%s: %s" % (source, line, qualified), file=output_file)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Query index of Neutron symbol usage')
+    parser.add_argument('-d', '--db', dest='db', required=True,
+                        help='Database created by scanner.py --db')
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument('--symbol', dest='symbol',
+                       help='Symbol name, or qualified by the module (e.g. '
+                       'neutron.common.rpc.get_client)')
+    group.add_argument('--module', dest='module',
+                       help='Module dotted name or path (e.g. '
+                       'neutron/common/rpc.py)')
+    group.add_argument('--source', dest='source',
+                       help='Source file path, or the end of it')
+    args = parser.parse_args()
+    if not os.path.isfile(args.db):
+        parser.error("No database '%s'" % args.db)
+
+    index = scanner.SymbolIndex(args.db)
+    if args.symbol:
+        rows = index.find_symbol(args.symbol)
+    elif args.module:
+        rows = index.find_module(args.module)
+    else:
+        rows = index.find_source(args.source)
+    print_rows(rows, sys.stdout)
+    index.close()
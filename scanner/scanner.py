@@ -16,37 +16,461 @@
 from __future__ import print_function
 
 import argparse
+import ast
+import collections
+import cProfile
 import fnmatch
+import functools
+import hashlib
+import heapq
+import json
+import multiprocessing
 import operator
 import os
 import re
+import shelve
+import shutil
+import sqlite3
+import subprocess
 import sys
+import tempfile
+import time
 
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
 
-import_re = re.compile(r'import\s+(neutron\.\S+)')
-from_re = re.compile(r'from\s+(neutron\.\S+)\s+import\s+([^#]+)')
-import_as_re = re.compile(r'import\s+(neutron\.\S+)\s+as\s+(\S+)')
-from_as_re = re.compile(r'from\s+(neutron\.\S+)\s+import\s+(\S+)\s+as\s+(\S+)')
-from_line_one_re = re.compile(r'from\s+(neutron\.\S+)\s+import\s+\(')
+try:
+    import resource
+except ImportError:
+    resource = None  # Not on Windows
+
+try:
+    intern
+except NameError:
+    intern = sys.intern  # Python 3
+
+
+def make_import_regexes(packages):
+    """Compile the regexes for imports from any of the packages."""
+    target = r'(?:%s)\.\S+' % '|'.join(re.escape(p) for p in packages)
+    return (re.compile(r'import\s+(%s)' % target),
+            re.compile(r'from\s+(%s)\s+import\s+([^#]+)' % target),
+            re.compile(r'import\s+(%s)\s+as\s+(\S+)' % target),
+            re.compile(r'from\s+(%s)\s+import\s+(\S+)\s+as\s+(\S+)' % target),
+            re.compile(r'from\s+(%s)\s+import\s+\(' % target))
+
+
+(import_re, from_re, import_as_re, from_as_re,
+ from_line_one_re) = make_import_regexes(['neutron'])
 from_line_two_re = re.compile(r'\s+(\S+)\s*\)')
 from_as_line_two_re = re.compile(r'\s+(\S+)\s+as\s+(\S+)\s*\)')
 
+identifier_re = re.compile(r'^[a-zA-Z_]\w*$')
+
 NEUTRON_BASE = '/opt/stack/neutron/'
 
+# Packages whose imports are tracked, and the directory each is found in
+targets = collections.OrderedDict([('neutron', NEUTRON_BASE)])
+
+# Compiled usage regexes, shared by all files scanned in this run. As
+# combined regexes are keyed by the aliases a file imports, which differ for
+# most files, the cache is cleared when it has this many entries.
+usage_regex_cache = {}
+USAGE_REGEX_CACHE_SIZE = 1000
+
+# Index of the directories of the target packages, once loaded
+neutron_index = None
+
+# Statistics for the run, when enabled
+scan_stats = None
+
+# Whether to record the line numbers of imports and usages
+record_locations = False
+
+PARSE_REGEXES = ('import_re', 'from_re', 'import_as_re', 'from_as_re',
+                 'from_line_one_re', 'from_line_two_re', 'from_as_line_two_re')
+
 
 class NeutronModuleNotFound(Exception):
 
     message = "Unable to find Neutron module '%(name)s'"
 
     def __init__(self, **kwargs):
+        self.kwargs = kwargs
         self.msg = self.message % kwargs
         super(NeutronModuleNotFound, self).__init__(self.msg)
 
+    def __reduce__(self):
+        # Allows the exception to be passed back from worker processes
+        return functools.partial(self.__class__, **self.kwargs), ()
+
+
+class GitCommandFailed(Exception):
+
+    message = "Command 'git %(command)s' failed: %(error)s"
+
+    def __init__(self, **kwargs):
+        self.kwargs = kwargs
+        self.msg = self.message % kwargs
+        super(GitCommandFailed, self).__init__(self.msg)
+
+    def __reduce__(self):
+        return functools.partial(self.__class__, **self.kwargs), ()
+
+
+class CountingRegex(object):
+
+    """Compiled regex wrapper, counting evaluations in the scan stats."""
+
+    def __init__(self, regex):
+        self.regex = regex
+
+    def match(self, string):
+        scan_stats.counters['regex_evaluations'] += 1
+        return self.regex.match(string)
+
+    def findall(self, string):
+        scan_stats.counters['regex_evaluations'] += 1
+        return self.regex.findall(string)
+
+
+class ScanStats(object):
+
+    """Time spent in each phase of a scan, and counts of the work done.
+
+    Phase times are summed over all processes, when using a pool, so they
+    can add up to more than the wall time.
+    """
+
+    def __init__(self):
+        self.wall_time = 0.0
+        self.peak_rss = self.peak_rss_workers = None
+        self.times = collections.defaultdict(float)
+        self.counters = collections.defaultdict(int)
+        self.file_times = []
+
+    def merge(self, other):
+        for phase, secs in other.times.items():
+            self.times[phase] += secs
+        for name, count in other.counters.items():
+            self.counters[name] += count
+        self.file_times.extend(other.file_times)
+
+    def timed(self, phase, func):
+        """Wrap func, so that time spent in it is added to the phase."""
+        def timed_func(*args):
+            start = time.time()
+            try:
+                return func(*args)
+            finally:
+                self.times[phase] += time.time() - start
+                self.counters[phase + '_calls'] += 1
+        return timed_func
+
+    def gen_timed(self, phase, iterable):
+        """Yield from iterable, adding time spent in it to the phase."""
+        iterator = iter(iterable)
+        while True:
+            start = time.time()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                self.times[phase] += time.time() - start
+            yield item
+
+    def read_lines(self, a_file):
+        lines = a_file.readlines()
+        self.counters['lines'] += len(lines)
+        self.counters['bytes'] += os.fstat(a_file.fileno()).st_size
+        return lines
+
+    def read_source(self, a_file):
+        source = a_file.read()
+        self.counters['lines'] += source.count('\n')
+        self.counters['bytes'] += os.fstat(a_file.fileno()).st_size
+        return source
+
+    def add_file(self, name, secs):
+        self.counters['files'] += 1
+        self.file_times.append((secs, name))
+
+    def as_dict(self, slowest=10):
+        rates = {}
+        if self.wall_time:
+            for name in ('files', 'lines', 'bytes'):
+                rates[name + '_per_sec'] = self.counters[name] / self.wall_time
+        return {
+            'wall_time': self.wall_time,
+            'phase_times': dict(self.times),
+            'counters': dict(self.counters),
+            'rates': rates,
+            'peak_rss': self.peak_rss,
+            'peak_rss_workers': self.peak_rss_workers,
+            'slowest_files': [[name, secs] for secs, name in
+                              heapq.nlargest(slowest, self.file_times)],
+        }
+
+    def report(self, output_file, slowest=10):
+        stats = self.as_dict(slowest)
+        counters = self.counters
+        print("Scan statistics", file=output_file)
+        print("    wall time: %.3f secs" % self.wall_time, file=output_file)
+        for name in ('files', 'lines', 'bytes'):
+            print("    %s: %d (%.0f per sec)" %
+                  (name, counters[name],
+                   stats['rates'].get(name + '_per_sec', 0)),
+                  file=output_file)
+        print("    phase times (secs):", file=output_file)
+        for phase, secs in sorted(self.times.items()):
+            print("        %-10s %8.3f" % (phase, secs), file=output_file)
+        print("    module resolution: %d stat calls, %d index lookups" %
+              (counters['stat_calls'], counters['index_lookups']),
+              file=output_file)
+        print("    regex evaluations: %d" % counters['regex_evaluations'],
+              file=output_file)
+        if self.peak_rss is not None:
+            print("    peak RSS: %.1f MB" % (self.peak_rss / 1048576.0),
+                  file=output_file)
+            if self.peak_rss_workers:
+                print("    peak RSS of largest worker: %.1f MB" %
+                      (self.peak_rss_workers / 1048576.0), file=output_file)
+        print("    slowest files:", file=output_file)
+        for name, secs in stats['slowest_files']:
+            print("        %8.3f %s" % (secs, name), file=output_file)
+
+
+def peak_rss():
+    """Peak RSS of this process and its largest finished child, in bytes.
+
+    Both are None, where the resource module is not available.
+    """
+    if resource is None:
+        return None, None
+    # Linux reports kilobytes, and OS X bytes
+    scale = 1 if sys.platform == 'darwin' else 1024
+    return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale,
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale)
+
 
-def gen_find(file_pattern, top):
-    for path, dirlist, filelist in os.walk(top):
+def set_targets(packages):
+    """Track imports of the packages, given as (package, directory) pairs.
+
+    The import regexes are rebuilt to match imports of any of the packages,
+    so that each file is still parsed once, however many are tracked.
+    """
+    global targets, neutron_index
+    global import_re, from_re, import_as_re, from_as_re, from_line_one_re
+    targets = collections.OrderedDict(packages)
+    neutron_index = None
+    (import_re, from_re, import_as_re, from_as_re,
+     from_line_one_re) = make_import_regexes(targets)
+
+
+def is_target_module(dotted_name):
+    package, dot, rest = dotted_name.partition('.')
+    return bool(rest) and package in targets
+
+
+def target_package(name):
+    """Target package that a module path (e.g. neutron/i18n.py) is in."""
+    package = name.split('/', 1)[0]
+    return package[:-3] if package.endswith('.py') else package
+
+
+def target_base(name):
+    return targets[target_package(name)]
+
+
+def enable_stats():
+    """Collect statistics for the scan, counting parsing regex use too."""
+    global scan_stats
+    scan_stats = ScanStats()
+    module_globals = globals()
+    for name in PARSE_REGEXES:
+        if not isinstance(module_globals[name], CountingRegex):
+            module_globals[name] = CountingRegex(module_globals[name])
+    return scan_stats
+
+
+def disable_stats():
+    global scan_stats
+    scan_stats = None
+    module_globals = globals()
+    for name in PARSE_REGEXES:
+        if isinstance(module_globals[name], CountingRegex):
+            module_globals[name] = module_globals[name].regex
+
+
+class IgnoreRules(object):
+
+    """Paths to leave out of scans, by exclude globs and .gitignore files.
+
+    Exclude globs are matched against the name of each file and directory,
+    and its path from the root (e.g. '.tox', 'neutron/tests'). With
+    gitignore, the patterns in the .gitignore files in the tree, and in
+    those above the root in the same git repo, are applied much as git does
+    (the last match wins, '!' includes a path again, and a trailing '/'
+    only matches directories), and the .git directory is left out too.
+
+    The rules for a directory are the root, its absolute path, and the
+    .gitignore patterns that apply to the directory.
+    """
+
+    def __init__(self, excludes=(), gitignore=False):
+        self.excludes = list(excludes)
+        self.gitignore = gitignore
+
+    @staticmethod
+    def read_gitignore(base):
+        """Return the patterns in the .gitignore file in base directory."""
+        try:
+            with open(os.path.join(base, '.gitignore')) as f:
+                lines = f.read().splitlines()
+        except (IOError, OSError):
+            return ()
+        patterns = []
+        for line in lines:
+            line = line.rstrip()
+            if not line or line.startswith('#'):
+                continue
+            negate = line.startswith('!')
+            if negate:
+                line = line[1:]
+            dir_only = line.endswith('/')
+            line = line.rstrip('/')
+            if line.startswith('**/'):
+                line = line[3:]
+            anchored = '/' in line
+            patterns.append((base, line.lstrip('/'), negate, dir_only,
+                             anchored))
+        return tuple(patterns)
+
+    def rules_for_root(self, top):
+        abs_top = os.path.abspath(top)
+        patterns = ()
+        if self.gitignore:
+            ancestors = []
+            path = abs_top
+            while not os.path.isdir(os.path.join(path, '.git')):
+                parent = os.path.dirname(path)
+                if parent == path:
+                    ancestors = []  # Not in a git repo
+                    break
+                path = parent
+                ancestors.append(path)
+            for base in reversed(ancestors):
+                patterns += self.read_gitignore(base)
+        return top, abs_top, patterns
+
+    def relpath(self, rules, path, name):
+        rel_dir = path[len(rules[0]):].lstrip(os.sep)
+        return os.path.join(rel_dir, name).replace(os.sep, '/')
+
+    def enter(self, rules, path, filenames):
+        """Rules for a directory, adding those in its .gitignore file."""
+        if self.gitignore and '.gitignore' in filenames:
+            top, abs_top, patterns = rules
+            base = os.path.join(abs_top, self.relpath(rules, path, ''))
+            rules = (top, abs_top,
+                     patterns + self.read_gitignore(base.rstrip(os.sep)))
+        return rules
+
+    def ignored(self, rules, path, name, is_dir):
+        rel_path = self.relpath(rules, path, name)
+        for exclude in self.excludes:
+            if fnmatch.fnmatch(name, exclude) or fnmatch.fnmatch(rel_path,
+                                                                 exclude):
+                return True
+        if not self.gitignore:
+            return False
+        if is_dir and name == '.git':
+            return True
+        full_path = os.path.join(rules[1], rel_path)
+        ignored = False
+        for base, pattern, negate, dir_only, anchored in rules[2]:
+            if dir_only and not is_dir:
+                continue
+            target = full_path[len(base) + 1:] if anchored else name
+            if fnmatch.fnmatchcase(target, pattern):
+                ignored = not negate
+        return ignored
+
+
+def list_dir(path):
+    """List a directory, returning its subdirectories, links and files.
+
+    As for os.walk(), symbolic links to directories are listed as
+    directories, and they are also returned as links, so that they are not
+    walked into. Uses scandir, when available, so that telling directories
+    from files needs no stat calls.
+    """
+    dirs = []
+    links = set()
+    files = []
+    try:
+        if scandir is not None:
+            for entry in scandir(path):
+                if entry.is_dir():
+                    dirs.append(entry.name)
+                    if entry.is_symlink():
+                        links.add(entry.name)
+                else:
+                    files.append(entry.name)
+        else:
+            for name in os.listdir(path):
+                full_path = os.path.join(path, name)
+                if os.path.isdir(full_path):
+                    dirs.append(name)
+                    if os.path.islink(full_path):
+                        links.add(name)
+                else:
+                    files.append(name)
+    except OSError:
+        pass
+    return dirs, links, files
+
+
+def gen_walk(top, ignore=None, rules=None):
+    """Walk the tree top down, in the same order as os.walk().
+
+    Yields the path, subdirectories, files and ignore rules of each
+    directory. Ignored directories are left out and never entered, but
+    files are left for the caller to check, after matching their names.
+    The rules for top can be those of its parent, when walking a subtree.
+    """
+    if ignore is not None and rules is None:
+        rules = ignore.rules_for_root(top)
+    stack = [(top, rules)]
+    while stack:
+        path, rules = stack.pop()
+        dirs, links, files = list_dir(path)
+        if ignore is not None:
+            rules = ignore.enter(rules, path, files)
+            dirs = [d for d in dirs
+                    if not ignore.ignored(rules, path, d, True)]
+        yield path, dirs, files, rules
+        stack.extend((os.path.join(path, d), rules) for d in reversed(dirs)
+                     if d not in links)
+
+
+def gen_find(file_pattern, top, ignore=None):
+    for path, dirlist, filelist, rules in gen_walk(top, ignore):
         for name in fnmatch.filter(filelist, file_pattern):
-            yield os.path.join(path, name)
+            if ignore is None or not ignore.ignored(rules, path, name, False):
+                yield os.path.join(path, name)
+
+
+def gen_find_roots(file_pattern, roots, ignore=None):
+    for root in roots:
+        for name in gen_find(file_pattern, root, ignore):
+            yield name
 
 
 def gen_open(filenames):
@@ -73,7 +497,7 @@ def gen_parse(a_file):
             if m:
                 yield True, base + '.' + target, alias
             else:
-                print ("Parse error:", line, file=output_file)
+                print ("Parse error:", line, file=sys.stderr)
             continue
         m = from_line_one_re.match(line)
         if m:
@@ -112,50 +536,342 @@ def gen_parse(a_file):
         yield False, line, None
 
 
+def git_head(base):
+    """Commit checked out in the git repo at base, or None if unknown."""
+    git_dir = os.path.join(base, '.git')
+    try:
+        with open(os.path.join(git_dir, 'HEAD')) as f:
+            head = f.read().strip()
+        if not head.startswith('ref: '):
+            return head
+        ref = head[len('ref: '):]
+        ref_file = os.path.join(git_dir, ref)
+        if os.path.isfile(ref_file):
+            with open(ref_file) as f:
+                return f.read().strip()
+        with open(os.path.join(git_dir, 'packed-refs')) as f:
+            for line in f:
+                if line.rstrip().endswith(' ' + ref):
+                    return line.split()[0]
+    except (IOError, OSError):
+        pass
+    return None
+
+
+class NeutronIndex(object):
+
+    """Directories and Python modules under a source tree.
+
+    Built with one walk of the tree, so that resolving imports needs no
+    filesystem calls. Paths are relative to the base, using '/'. The index
+    can be saved to disk and reused while the tree is unchanged, which is
+    determined by the git HEAD or, for trees not under git, by the mtimes
+    of the directories.
+    """
+
+    def __init__(self, base, head=None, dirs=None, modules=None):
+        self.base = base
+        self.head = head
+        self.dirs = dirs if dirs is not None else {}
+        self.modules = modules if modules is not None else set()
+
+    @classmethod
+    def build(cls, base):
+        index = cls(base, head=git_head(base))
+        for path, dirlist, filelist in os.walk(base):
+            dirlist[:] = [d for d in dirlist if not d.startswith('.')]
+            rel_path = os.path.relpath(path, base).replace(os.sep, '/')
+            index.dirs[rel_path] = os.path.getmtime(path)
+            prefix = rel_path + '/' if rel_path != '.' else ''
+            for name in fnmatch.filter(filelist, '*.py'):
+                index.modules.add(prefix + name)
+        return index
+
+    @classmethod
+    def from_dict(cls, contents):
+        return cls(contents['base'], head=contents['head'],
+                   dirs=contents['dirs'], modules=set(contents['modules']))
+
+    def as_dict(self):
+        return {'base': self.base, 'head': self.head,
+                'dirs': self.dirs, 'modules': sorted(self.modules)}
+
+    @classmethod
+    def load(cls, filename):
+        with open(filename) as f:
+            return cls.from_dict(json.load(f))
+
+    def save(self, filename):
+        with open(filename, 'w') as f:
+            json.dump(self.as_dict(), f)
+
+    def is_current(self, base):
+        if os.path.normpath(base) != os.path.normpath(self.base):
+            return False
+        if self.head:
+            return self.head == git_head(base)
+        for rel_path, mtime in self.dirs.items():
+            try:
+                if os.path.getmtime(os.path.join(base, rel_path)) != mtime:
+                    return False
+            except OSError:
+                return False
+        return True
+
+    def fingerprint(self):
+        """Digest of the contents that module resolution depends upon."""
+        digest = hashlib.sha1()
+        for name in sorted(self.dirs) + sorted(self.modules):
+            digest.update(name.encode('utf-8') + b'\n')
+        return digest.hexdigest()
+
+    def isdir(self, name):
+        return os.path.normpath(name) in self.dirs
+
+    def isfile(self, name):
+        return os.path.normpath(name) in self.modules
+
+
+class TargetIndex(object):
+
+    """Indexes of the directories that the target packages are in.
+
+    A path is looked up in the index of its package's directory, so that
+    packages from different trees can be resolved. Packages in the same
+    directory share an index.
+    """
+
+    def __init__(self, indexes):
+        self.indexes = indexes
+
+    @staticmethod
+    def load_saved(filename):
+        """Return the saved indexes, by their normalized directory."""
+        with open(filename) as f:
+            contents = json.load(f)
+        indexes = (NeutronIndex.from_dict(index)
+                   for index in contents.get('indexes', []))
+        return dict((os.path.normpath(index.base), index)
+                    for index in indexes)
+
+    def save(self, filename):
+        indexes = dict((id(index), index) for index in self.indexes.values())
+        with open(filename, 'w') as f:
+            json.dump({'indexes': [index.as_dict()
+                                   for index in indexes.values()]}, f)
+
+    def fingerprint(self):
+        """Digest of the packages, and the contents of their indexes."""
+        digest = hashlib.sha1()
+        for package, index in self.indexes.items():
+            digest.update(('%s:%s\n' % (package, index.fingerprint())).encode(
+                'utf-8'))
+        return digest.hexdigest()
+
+    def index_for(self, name):
+        return self.indexes.get(target_package(name))
+
+    def isdir(self, name):
+        index = self.index_for(name)
+        return index is not None and index.isdir(name)
+
+    def isfile(self, name):
+        index = self.index_for(name)
+        return index is not None and index.isfile(name)
+
+
+def load_neutron_index(cache_file=None):
+    """Index the target packages' directories, reusing saved indexes."""
+    global neutron_index
+    saved = {}
+    if cache_file and os.path.isfile(cache_file):
+        saved = TargetIndex.load_saved(cache_file)
+    indexes = collections.OrderedDict()
+    rebuilt = False
+    for package, base in targets.items():
+        index = saved.get(os.path.normpath(base))
+        if index is None or not index.is_current(base):
+            index = NeutronIndex.build(base)
+            saved[os.path.normpath(base)] = index
+            rebuilt = True
+        indexes[package] = index
+    neutron_index = TargetIndex(indexes)
+    if cache_file and rebuilt:
+        neutron_index.save(cache_file)
+    return neutron_index
+
+
+def neutron_isdir(name):
+    if neutron_index is not None:
+        if scan_stats is not None:
+            scan_stats.counters['index_lookups'] += 1
+        return neutron_index.isdir(name)
+    if scan_stats is not None:
+        scan_stats.counters['stat_calls'] += 1
+    return os.path.isdir(os.path.join(target_base(name), name))
+
+
+def neutron_isfile(name):
+    if neutron_index is not None:
+        if scan_stats is not None:
+            scan_stats.counters['index_lookups'] += 1
+        return neutron_index.isfile(name)
+    if scan_stats is not None:
+        scan_stats.counters['stat_calls'] += 1
+    return os.path.isfile(os.path.join(target_base(name), name))
+
+
 class NeutronModule(object):
 
+    # Names and references are interned, as the same ones are used by many
+    # files, and the cache and watch mode keep the results for every file
+    __slots__ = ('dotted_name', 'name', 'refs', 'locations')
+
     def __init__(self, name):
         self.dotted_name = name
         self.name = name.replace('.', '/')
         self.refs = set()
-        # See if the import is a directory first
-        if os.path.isdir(os.path.join(NEUTRON_BASE, self.name)):
-            return
-        # Try import as a module
-        self.name += ".py"
-        if not os.path.isfile(os.path.join(NEUTRON_BASE, self.name)):
-            # Assume this is an object in the module
-            parts = name.split('.')
-            alias = parts.pop()
-            self.dotted_name = '.'.join(parts)
-            self.name = '/'.join(parts) + ".py"
-            if not os.path.isfile(os.path.join(NEUTRON_BASE, self.name)):
-                raise NeutronModuleNotFound(name=name)
-            self.add_usage(alias)
-
-    def add_usage(self, reference):
+        self.locations = [] if record_locations else None
+        # See if the import is a directory first, else try it as a module
+        if not neutron_isdir(self.name):
+            self.name += ".py"
+            if not neutron_isfile(self.name):
+                # Assume this is an object in the module
+                parts = name.split('.')
+                alias = parts.pop()
+                self.dotted_name = '.'.join(parts)
+                self.name = '/'.join(parts) + ".py"
+                if not neutron_isfile(self.name):
+                    raise NeutronModuleNotFound(name=name)
+                self.add_usage(alias)
+        self.dotted_name = intern(self.dotted_name)
+        self.name = intern(self.name)
+
+    @classmethod
+    def from_report(cls, dotted_name, name, refs, locations=None):
+        """Recreate an already resolved module, without resolving it."""
+        module = cls.__new__(cls)
+        module.dotted_name = intern(str(dotted_name))
+        module.name = intern(str(name))
+        module.refs = set(intern(str(ref)) for ref in refs)
+        module.locations = ([(intern(str(ref)), line)
+                             for ref, line in locations]
+                            if locations is not None else None)
+        return module
+
+    def add_usage(self, reference, lineno=None):
+        reference = intern(reference)
         self.refs.add(reference)
+        if lineno is not None and self.locations is not None:
+            self.locations.append((reference, lineno))
 
 
 class ImportAlias(object):
 
+    __slots__ = ('name', 'module_name', '_regex')
+
     def __init__(self, name, for_module):
         self.name = name
-        self.regex = self.make_usage_regex(name)
         self.module_name = for_module
+        self._regex = None
+
+    @property
+    def regex(self):
+        """Regex for usages of this alias alone, compiled when first used.
+
+        Only needed for aliases that cannot be in the combined regex.
+        """
+        if self._regex is None:
+            self._regex = self.make_usage_regex(self.name)
+        return self._regex
+
+    @staticmethod
+    def cached_regex(key, pattern):
+        regex = usage_regex_cache.get(key)
+        if regex is None:
+            if len(usage_regex_cache) >= USAGE_REGEX_CACHE_SIZE:
+                usage_regex_cache.clear()
+            regex = re.compile(pattern)
+            usage_regex_cache[key] = regex
+        return regex if scan_stats is None else CountingRegex(regex)
 
     @classmethod
     def make_usage_regex(cls, alias):
-        return re.compile(r'[^\w.]' + alias + r'\.([a-zA-Z0-9_.]+)')
+        return cls.cached_regex(alias,
+                                r'[^\w.]' + alias + r'\.([a-zA-Z0-9_.]+)')
+
+    @classmethod
+    def make_combined_usage_regex(cls, aliases):
+        """Regex matching a usage of any of the (identifier) aliases.
+
+        The aliases are sorted, so that files importing the same aliases
+        share the compiled regex.
+        """
+        key = tuple(sorted(aliases))
+        return cls.cached_regex(key, r'[^\w.](' + '|'.join(key) +
+                                r')\.([a-zA-Z0-9_.]+)')
+
+
+class ImportUsageVisitor(ast.NodeVisitor):
+
+    """Collects Neutron imports and attribute usages from a syntax tree.
+
+    Follows the same conventions as gen_parse(): an import is known by its
+    alias, or by the last part of the imported name, and a usage is the
+    chain of attributes following an alias. Each is recorded as an event
+    with its position, so that they can be applied in source order.
+    """
+
+    def __init__(self):
+        self.events = []
+
+    def visit_Import(self, node):
+        for name in node.names:
+            if is_target_module(name.name):
+                alias = name.asname or name.name.split('.')[-1]
+                self.events.append((node.lineno, node.col_offset, True,
+                                    alias, name.name))
+
+    def visit_ImportFrom(self, node):
+        if node.level or not is_target_module(node.module or ''):
+            return
+        for name in node.names:
+            self.events.append((node.lineno, node.col_offset, True,
+                                name.asname or name.name,
+                                node.module + '.' + name.name))
+
+    def visit_Attribute(self, node):
+        attributes = []
+        value = node
+        while isinstance(value, ast.Attribute):
+            attributes.append(value.attr)
+            value = value.value
+        if isinstance(value, ast.Name):
+            self.events.append((node.lineno, node.col_offset, False,
+                                value.id, '.'.join(reversed(attributes))))
+        else:
+            self.visit(value)
+
+
+def parse_events(source, filename):
+    """Parse source, returning the import and usage events in order."""
+    visitor = ImportUsageVisitor()
+    visitor.visit(ast.parse(source, filename))
+    return sorted(visitor.events)
 
 
 class SourceScanner(object):
 
-    def __init__(self, name, output_file):
+    def __init__(self, name, output_file=sys.stdout, source=None):
         self.known_aliases = {}
         self.imported_modules = {}
         self.name = name
         self.output_file = output_file
+        # Contents to analyze instead of the file's (e.g. from git)
+        self.source = source
+        self.usage_regex = None
+        self.other_aliases = []
+        self.lineno = None
 
     def add_import(self, alias, module_name):
         new_module = NeutronModule(module_name)
@@ -164,27 +880,116 @@ class SourceScanner(object):
             self.imported_modules[module_name].refs |= new_module.refs
         else:
             self.imported_modules[module_name] = new_module
+        module = self.imported_modules[module_name]
+        if module.locations is not None and self.lineno is not None:
+            # The import itself, and any objects it imports
+            module.locations.append(('', self.lineno))
+            module.locations.extend((ref, self.lineno)
+                                    for ref in new_module.refs)
         self.known_aliases[alias] = ImportAlias(alias, module_name)
+        self.usage_regex = None
+
+    def build_usage_matcher(self):
+        """Combine aliases into one regex, so each line is searched once.
+
+        Aliases that are not plain identifiers (e.g. '*') cannot be used in
+        an alternation, so they keep their own regex.
+        """
+        aliases = [a for a in self.known_aliases if identifier_re.match(a)]
+        self.other_aliases = [self.known_aliases[a]
+                              for a in self.known_aliases
+                              if not identifier_re.match(a)]
+        if aliases:
+            self.usage_regex = ImportAlias.make_combined_usage_regex(aliases)
+        else:
+            self.usage_regex = False
 
     def find_import_usage(self, line):
-        for alias_info in self.known_aliases.values():
+        if self.usage_regex is None:
+            self.build_usage_matcher()
+        if self.usage_regex:
+            for alias, match in self.usage_regex.findall(line):
+                alias_info = self.known_aliases[alias]
+                module = self.imported_modules[alias_info.module_name]
+                module.add_usage(match, self.lineno)
+        for alias_info in self.other_aliases:
             m = alias_info.regex.findall(line)
             module = self.imported_modules[alias_info.module_name]
             for match in m:
-                module.add_usage(match)
+                module.add_usage(match, self.lineno)
+
+    def gen_numbered(self, lines):
+        """Yield the lines, tracking the current line number."""
+        self.lineno = 0
+        for line in lines:
+            self.lineno += 1
+            yield line
 
     def report_for_source_module(self):
         print("Analysis for", self.name, file=self.output_file)
         report_modules(self.imported_modules, self.output_file)
 
     def analyze(self):
+        if self.source is not None:
+            self.analyze_lines(self.source.splitlines(True))
+            return
         with open(self.name) as o:
-            parsed_lines = gen_parse(o)
-            for is_import, content, name in parsed_lines:
-                if is_import:
-                    self.add_import(name, content)
+            lines = o
+            if scan_stats is not None:
+                lines = scan_stats.timed('read', scan_stats.read_lines)(o)
+            self.analyze_lines(lines)
+
+    def analyze_lines(self, lines):
+        add_import = self.add_import
+        find_import_usage = self.find_import_usage
+        if record_locations:
+            lines = self.gen_numbered(lines)
+        parsed_lines = gen_parse(lines)
+        if scan_stats is not None:
+            parsed_lines = scan_stats.gen_timed('parse', parsed_lines)
+            add_import = scan_stats.timed('resolve', add_import)
+            find_import_usage = scan_stats.timed('match', find_import_usage)
+        for is_import, content, name in parsed_lines:
+            if is_import:
+                add_import(name, content)
+            else:
+                find_import_usage(content)
+
+    def analyze_ast(self):
+        """Analyze the file using its syntax tree, in a single walk.
+
+        Files that cannot be parsed by this Python version (e.g. Python 2
+        only source, under Python 3, or source with null bytes, which
+        Python 2 rejects with TypeError) are analyzed with the regex parser.
+        Returns whether the syntax tree was used.
+        """
+        add_import = self.add_import
+        parse = parse_events
+        if scan_stats is not None:
+            add_import = scan_stats.timed('resolve', add_import)
+            parse = scan_stats.timed('parse', parse)
+        if self.source is not None:
+            source = self.source
+        else:
+            with open(self.name) as o:
+                if scan_stats is None:
+                    source = o.read()
                 else:
-                    self.find_import_usage(content)
+                    source = scan_stats.timed('read',
+                                              scan_stats.read_source)(o)
+        try:
+            events = parse(source, self.name)
+        except (SyntaxError, TypeError, ValueError):
+            self.analyze()
+            return False
+        for lineno, _, is_import, alias, name in events:
+            self.lineno = lineno
+            if is_import:
+                add_import(alias, name)
+            elif alias in self.known_aliases:
+                module_name = self.known_aliases[alias].module_name
+                self.imported_modules[module_name].add_usage(name, lineno)
+        return True
 
 
 def report_modules(modules, output_file):
@@ -195,41 +1000,1253 @@ def report_modules(modules, output_file):
             print("        %s" % ref, file=output_file)
 
 
+def write_summary_jsonl(modules, filename):
+    """Write summary as JSON Lines, one module per line, in path order.
+
+    Each line has the module's path, dotted name and sorted references,
+    so that merge.py can load summaries without parsing the text report.
+    """
+    with open(filename, 'w') as f:
+        for module in sorted(modules.values(), key=lambda m: m.name):
+            f.write(json.dumps({'module': module.name,
+                                'dotted_name': module.dotted_name,
+                                'refs': sorted(module.refs)},
+                               sort_keys=True))
+            f.write('\n')
+
+
+def scan_source_file(name, engine='regex', source=None):
+    """Analyze a source file, returning the Neutron modules it uses."""
+    start = time.time()
+    source_scan = SourceScanner(name, source=source)
+    if engine == 'ast':
+        source_scan.analyze_ast()
+    else:
+        source_scan.analyze()
+    if scan_stats is not None:
+        scan_stats.add_file(name, time.time() - start)
+    return name, source_scan.imported_modules
+
+
+def scan_source_file_with_stats(name, engine='regex'):
+    """Analyze a source file in a worker, returning the stats for it too."""
+    file_stats = enable_stats()
+    name, imported_modules = scan_source_file(name, engine)
+    return name, imported_modules, file_stats
+
+
+def init_scan_worker(index, locations=False, packages=None):
+    global neutron_index
+    global record_locations
+    if packages is not None:
+        set_targets(packages)
+    neutron_index = index
+    record_locations = locations
+
+
+def gen_analyze(filenames, jobs=1, engine='regex'):
+    """Analyze the files, yielding results in the order of the filenames.
+
+    With more than one job, the files are analyzed by a pool of processes
+    (jobs of zero means one per CPU).
+    """
+    if jobs == 1:
+        for name in filenames:
+            yield scan_source_file(name, engine)
+        return
+    with_stats = scan_stats is not None
+    if with_stats:
+        scan = functools.partial(scan_source_file_with_stats, engine=engine)
+    else:
+        scan = functools.partial(scan_source_file, engine=engine)
+    pool = multiprocessing.Pool(jobs or None, initializer=init_scan_worker,
+                                initargs=(neutron_index, record_locations,
+                                          list(targets.items())))
+    try:
+        for result in pool.imap(scan, filenames, chunksize=16):
+            if with_stats:
+                name, imported_modules, file_stats = result
+                scan_stats.merge(file_stats)
+                result = name, imported_modules
+            yield result
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def gen_ordered_results(filenames, known, fresh):
+    """Yield known results, and the others from fresh, in filename order."""
+    for name in filenames:
+        if name in known:
+            yield name, known[name]
+        else:
+            yield next(fresh)
+
+
+class Prefilter(object):
+
+    """Cheap check for source files that cannot import Neutron modules.
+
+    The whole file is searched with one regex, for the imports that the
+    engine would recognize, so that other files can skip line by line
+    parsing. The AST engine recognizes imports anywhere in a line, so only
+    a Neutron module name is looked for. Imports of any of the target
+    packages are looked for.
+    """
+
+    engine_patterns = {
+        'regex': r'(?:^|[\r\n])(?:import|from)\s+(?:%s)\.',
+        'ast': r'(?:%s)\.',
+    }
+
+    def __init__(self, engine='regex'):
+        packages = '|'.join(re.escape(p) for p in targets)
+        self.regex = re.compile(
+            (self.engine_patterns[engine] % packages).encode('ascii'))
+        self.files_checked = self.files_skipped = 0
+        self.bytes_checked = self.bytes_skipped = 0
+
+    def may_import(self, name):
+        with open(name, 'rb') as f:
+            contents = f.read()
+        self.files_checked += 1
+        self.bytes_checked += len(contents)
+        if self.regex.search(contents):
+            return True
+        self.files_skipped += 1
+        self.bytes_skipped += len(contents)
+        return False
+
+    def report(self, output_file):
+        print("Prefilter skipped %d of %d files (%d of %d bytes)" %
+              (self.files_skipped, self.files_checked,
+               self.bytes_skipped, self.bytes_checked), file=output_file)
+
+
+def gen_scan(filenames, jobs=1, engine='regex', prefilter=None):
+    """Analyze the files, yielding results in the order of the filenames.
+
+    Files rejected by the prefilter are not analyzed, and have no modules.
+    """
+    if prefilter is None:
+        return gen_analyze(filenames, jobs, engine)
+    may_import = prefilter.may_import
+    if scan_stats is not None:
+        may_import = scan_stats.timed('prefilter', may_import)
+    filenames = list(filenames)
+    skipped = dict((name, {}) for name in filenames if not may_import(name))
+    fresh = gen_analyze([name for name in filenames if name not in skipped],
+                        jobs, engine)
+    return gen_ordered_results(filenames, skipped, fresh)
+
+
+class ScanCache(object):
+
+    """Results of previous scans, for files that have not changed since.
+
+    Entries are keyed by the absolute path of the source file, and are
+    valid while the file's mtime and size are the same. The whole cache is
+    discarded if the fingerprint changes, which identifies the Neutron tree
+    that modules were resolved against and the engine used. When line
+    numbers are being recorded, entries saved without them are not used.
+    """
+
+    version = 1
+
+    def __init__(self, fingerprint, entries=None):
+        self.fingerprint = fingerprint
+        self.entries = entries if entries is not None else {}
+        self.updated = {}
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def load(cls, filename, fingerprint):
+        if os.path.isfile(filename):
+            with open(filename) as f:
+                contents = json.load(f)
+            if (contents.get('version') == cls.version and
+                    contents.get('fingerprint') == fingerprint):
+                return cls(fingerprint, contents['files'])
+        return cls(fingerprint)
+
+    def save(self, filename, roots=()):
+        """Save the entries checked, with the others that were loaded.
+
+        Entries that were not checked (e.g. for another tree sharing the
+        cache file) are kept, unless the file is under one of the roots
+        scanned and no longer exists.
+        """
+        roots = [os.path.join(os.path.abspath(root), '') for root in roots]
+        files = dict((key, entry) for key, entry in self.entries.items()
+                     if os.path.exists(key) or
+                     not any(key.startswith(root) for root in roots))
+        files.update(self.updated)
+        with open(filename, 'w') as f:
+            json.dump({'version': self.version,
+                       'fingerprint': self.fingerprint,
+                       'files': files}, f)
+
+    def check(self, name):
+        """Return whether the cached entry for the file is current.
+
+        The file's key is remembered, so that a fresh result can be stored
+        with add() or the cached one kept for the next save.
+        """
+        key = os.path.abspath(name)
+        stat = os.stat(name)
+        signature = [stat.st_mtime, stat.st_size]
+        entry = self.entries.get(key)
+        if (entry is not None and entry[:2] == signature and
+                not (record_locations and
+                     any(len(module) < 4 for module in entry[2]))):
+            self.hits += 1
+            self.updated[key] = entry
+            return True
+        self.misses += 1
+        self.updated[key] = signature + [None]
+        return False
+
+    def modules(self, name):
+        """Recreate the modules for a file with a current entry."""
+        entry = self.updated[os.path.abspath(name)]
+        return dict((module[0], NeutronModule.from_report(*module))
+                    for module in entry[2])
+
+    def lookup(self, name):
+        """Return cached modules for the file, or None if not current."""
+        return self.modules(name) if self.check(name) else None
+
+    def add(self, name, imported_modules):
+        entry = self.updated[os.path.abspath(name)]
+        entry[2] = [[m.dotted_name, m.name, sorted(m.refs)] +
+                    ([m.locations] if m.locations is not None else [])
+                    for m in imported_modules.values()]
+
+    def remove(self, name):
+        key = os.path.abspath(name)
+        self.updated.pop(key, None)
+        self.entries.pop(key, None)
+
+
+class SymbolIndex(object):
+
+    """SQLite index of where Neutron modules and symbols are used.
+
+    There is a row for each import of a module (with an empty symbol) and
+    for each usage of a symbol from the module, with the source file and
+    line number. Rows are replaced, as files are rescanned.
+    """
+
+    schema = """
+        CREATE TABLE IF NOT EXISTS usage (
+            module TEXT NOT NULL,
+            path TEXT NOT NULL,
+            symbol TEXT NOT NULL,
+            qualified TEXT NOT NULL,
+            source TEXT NOT NULL,
+            line INTEGER);
+        CREATE INDEX IF NOT EXISTS usage_module ON usage (module);
+        CREATE INDEX IF NOT EXISTS usage_symbol ON usage (symbol);
+        CREATE INDEX IF NOT EXISTS usage_qualified ON usage (qualified);
+        CREATE INDEX IF NOT EXISTS usage_source ON usage (source);
+    """
+
+    columns = 'module, path, symbol, qualified, source, line'
+
+    def __init__(self, filename):
+        self.db = sqlite3.connect(filename)
+        self.db.executescript(self.schema)
+
+    def commit(self):
+        self.db.commit()
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
+
+    def update_file(self, name, imported_modules):
+        source = os.path.abspath(name)
+        self.db.execute('DELETE FROM usage WHERE source = ?', (source,))
+        rows = []
+        for module in imported_modules.values():
+            for symbol, line in module.locations or []:
+                qualified = module.dotted_name
+                if symbol:
+                    qualified += '.' + symbol
+                rows.append((module.dotted_name, module.name, symbol,
+                             qualified, source, line))
+        self.db.executemany('INSERT INTO usage VALUES (?, ?, ?, ?, ?, ?)',
+                            rows)
+
+    def remove_missing(self, root, seen):
+        """Remove files under root that were not seen in the last scan."""
+        prefix = os.path.join(os.path.abspath(root), '')
+        seen = set(os.path.abspath(name) for name in seen)
+        cursor = self.db.execute(
+            'SELECT DISTINCT source FROM usage WHERE substr(source, 1, ?) = ?',
+            (len(prefix), prefix))
+        for (source,) in cursor.fetchall():
+            if source not in seen:
+                self.db.execute('DELETE FROM usage WHERE source = ?',
+                                (source,))
+
+    def query(self, where, args):
+        return self.db.execute(
+            'SELECT %s FROM usage WHERE %s ORDER BY source, line, qualified' %
+            (self.columns, where), args).fetchall()
+
+    def find_symbol(self, symbol):
+        """Usages of a symbol, by its name or qualified by its module."""
+        return self.query('qualified = ? OR symbol = ?', (symbol, symbol))
+
+    def find_module(self, module):
+        """Imports and usages of a module, by its dotted name or path."""
+        return self.query('module = ? OR path = ?', (module, module))
+
+    def find_source(self, source):
+        """Imports and usages in a source file, by its path (or a suffix)."""
+        source = os.path.abspath(source) if os.path.exists(source) else source
+        suffix = '/' + source
+        return self.query('source = ? OR substr(source, -?) = ?',
+                          (source, len(suffix), suffix))
+
+
+class SpilledResults(object):
+
+    """Modules used by each file, kept in a file instead of in memory.
+
+    A mapping of source file name to its modules, for watch mode, stored
+    with shelve in a temporary directory, so that memory use does not grow
+    with the number of files. Modules are stored as (dotted name, path,
+    references) tuples, and recreated when read.
+    """
+
+    def __init__(self, directory=None):
+        self.directory = tempfile.mkdtemp(prefix='scanner-', dir=directory)
+        self.shelf = shelve.open(os.path.join(self.directory, 'results'),
+                                 protocol=2)
+
+    def __setitem__(self, name, imported_modules):
+        self.shelf[name] = [(m.dotted_name, m.name, sorted(m.refs))
+                            for m in imported_modules.values()]
+
+    def __getitem__(self, name):
+        return dict((module[0], NeutronModule.from_report(*module))
+                    for module in self.shelf[name])
+
+    def get(self, name, default=None):
+        if name not in self.shelf:
+            return default
+        return self[name]
+
+    def pop(self, name, default=None):
+        imported_modules = self.get(name, default)
+        if name in self.shelf:
+            del self.shelf[name]
+        return imported_modules
+
+    def items(self):
+        for name in self.shelf.keys():
+            yield name, self[name]
+
+    def close(self):
+        self.shelf.close()
+        shutil.rmtree(self.directory)
+
+
+class TreeWatcher(object):
+
+    """Polls a tree for source files that were changed, added or removed.
+
+    Each poll only stats the files and directories already seen. A directory
+    is only listed again when its mtime changes, as it does when entries are
+    added to or removed from it, so the tree is not walked again.
+    """
+
+    def __init__(self, file_pattern, tops, ignore=None):
+        self.file_pattern = file_pattern
+        self.ignore = ignore
+        self.dirs = {}
+        self.rules = {}
+        self.files = {}
+        for top in tops:
+            self.add_tree(top)
+
+    @staticmethod
+    def signature(name):
+        try:
+            stat = os.stat(name)
+        except OSError:
+            return None
+        return stat.st_mtime, stat.st_size
+
+    def add_file(self, name):
+        signature = self.signature(name)
+        if signature is None:
+            return False
+        self.files[name] = signature
+        return True
+
+    def is_ignored(self, path, name, is_dir):
+        return (self.ignore is not None and
+                self.ignore.ignored(self.rules[path], path, name, is_dir))
+
+    def add_tree(self, top, rules=None):
+        """Record the directories and files under top, returning the files."""
+        added = []
+        for path, dirlist, filelist, rules in gen_walk(top, self.ignore,
+                                                       rules):
+            signature = self.signature(path)
+            if signature is None:
+                continue
+            self.dirs[path] = signature[0]
+            self.rules[path] = rules
+            added.extend(name for name in
+                         (os.path.join(path, f) for f in
+                          fnmatch.filter(filelist, self.file_pattern)
+                          if not self.is_ignored(path, f, False))
+                         if self.add_file(name))
+        return added
+
+    def poll(self):
+        """Return the files changed or added, and the files removed."""
+        changed = []
+        for path, mtime in list(self.dirs.items()):
+            signature = self.signature(path)
+            if signature is None:
+                del self.dirs[path]
+                continue
+            if signature[0] == mtime:
+                continue
+            self.dirs[path] = signature[0]
+            dirs, links, files = list_dir(path)
+            for entry in dirs:
+                name = os.path.join(path, entry)
+                if (name not in self.dirs and entry not in links and
+                        not self.is_ignored(path, entry, True)):
+                    changed.extend(self.add_tree(name, self.rules[path]))
+            for entry in fnmatch.filter(files, self.file_pattern):
+                name = os.path.join(path, entry)
+                if (name not in self.files and
+                        not self.is_ignored(path, entry, False) and
+                        self.add_file(name)):
+                    changed.append(name)
+        added = set(changed)
+        removed = []
+        for name, signature in list(self.files.items()):
+            current = self.signature(name)
+            if current is None:
+                del self.files[name]
+                removed.append(name)
+            elif current != signature:
+                self.files[name] = current
+                if name not in added:
+                    changed.append(name)
+        return sorted(changed), sorted(removed)
+
+
+def gen_cached_scan(filenames, cache, jobs=1, engine='regex',
+                    prefilter=None):
+    """Like gen_scan(), but only analyze files that are not in the cache.
+
+    Cached modules are only recreated as they are yielded, so that the
+    results for all cached files are not in memory at once.
+    """
+    filenames = list(filenames)
+    cached = set(name for name in filenames if cache.check(name))
+    fresh = gen_scan([name for name in filenames if name not in cached],
+                     jobs, engine, prefilter)
+    for name in filenames:
+        if name in cached:
+            yield name, cache.modules(name)
+        else:
+            name, imported_modules = next(fresh)
+            cache.add(name, imported_modules)
+            yield name, imported_modules
+
+
+def module_references(imported_modules):
+    """Flatten modules to (module, reference) pairs, for comparisons."""
+    references = set()
+    for module in imported_modules.values():
+        references.add((module.name, ''))
+        references.update((module.name, ref) for ref in module.refs)
+    return references
+
+
+def compare_engines(files, output_file):
+    """Analyze files with both engines, reporting differences and times."""
+    regex_time = ast_time = 0.0
+    num_files = num_different = num_fallbacks = 0
+    for name in files:
+        num_files += 1
+        start = time.time()
+        regex_scan = SourceScanner(name)
+        regex_scan.analyze()
+        regex_time += time.time() - start
+        start = time.time()
+        ast_scan = SourceScanner(name)
+        if not ast_scan.analyze_ast():
+            num_fallbacks += 1
+        ast_time += time.time() - start
+
+        regex_refs = module_references(regex_scan.imported_modules)
+        ast_refs = module_references(ast_scan.imported_modules)
+        if regex_refs == ast_refs:
+            continue
+        num_different += 1
+        print("Differences for", name, file=output_file)
+        for engine, refs in (('regex', regex_refs - ast_refs),
+                             ('ast', ast_refs - regex_refs)):
+            for module_name, ref in sorted(refs):
+                print("    %-5s only: %s %s" % (engine, module_name, ref),
+                      file=output_file)
+    print("Compared %d files, %d with differences" %
+          (num_files, num_different), file=output_file)
+    print("    regex engine: %.3f secs" % regex_time, file=output_file)
+    print("    ast engine:   %.3f secs (%d files used regex, as they could "
+          "not be parsed)" % (ast_time, num_fallbacks), file=output_file)
+
+
+def git(args, cwd, stdin=None):
+    """Run git in the directory, returning its output."""
+    process = subprocess.Popen(['git'] + args, cwd=cwd,
+                               stdin=subprocess.PIPE if stdin else None,
+                               stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    output, error = process.communicate(stdin)
+    if process.returncode:
+        raise GitCommandFailed(command=' '.join(args),
+                               error=error.decode('utf-8', 'replace').strip())
+    return output
+
+
+def git_revisions(revisions, cwd):
+    """Return the base and new revisions to compare, for a range.
+
+    Like git diff, 'A..B' compares A with B, 'A...B' compares the merge base
+    of A and B with B, and 'A' compares A with the working tree (for which
+    the new revision is None).
+    """
+    if '...' in revisions:
+        base, new = revisions.split('...', 1)
+        new = new or 'HEAD'
+        base = git(['merge-base', base or 'HEAD', new],
+                   cwd).decode('utf-8').strip()
+        return base, new
+    if '..' in revisions:
+        base, new = revisions.split('..', 1)
+        return base or 'HEAD', new or 'HEAD'
+    return revisions, None
+
+
+def git_changed_files(root, base, new):
+    """Return the status and path of Python files changed under the root.
+
+    Paths are relative to the root. Renames are treated as a delete and an
+    add, so that the references in both files are compared.
+    """
+    args = ['diff', '--name-status', '-z', '--relative', '--no-renames', base]
+    if new:
+        args.append(new)
+    fields = git(args + ['--', '*.py'], root).decode('utf-8').split('\0')
+    return [(status[0], path)
+            for status, path in zip(fields[0::2], fields[1::2])]
+
+
+def git_contents(root, objects):
+    """Return the contents of each revision:path, or None if it is missing.
+
+    All are read by one git process, rather than one for each file.
+    """
+    if not objects:
+        return []
+    stdin = ''.join('%s:./%s\n' % o for o in objects).encode('utf-8')
+    output = git(['cat-file', '--batch'], root, stdin)
+    contents = []
+    offset = 0
+    for _ in objects:
+        end = output.index(b'\n', offset)
+        header = output[offset:end].split()
+        offset = end + 1
+        if header[-1] == b'missing':
+            contents.append(None)
+            continue
+        size = int(header[2])
+        content = output[offset:offset + size]
+        if not isinstance(content, str):
+            content = content.decode('utf-8', 'replace')
+        contents.append(content)
+        offset += size + 1
+    return contents
+
+
+def gen_git_diff_scan(root, revisions, engine='regex'):
+    """Analyze the Python files changed in the revisions, before and after.
+
+    Yields the name of each file, and the modules it uses in the base and
+    the new revision (empty when it does not exist in that revision).
+    """
+    base, new = git_revisions(revisions, root)
+    changed = git_changed_files(root, base, new)
+    base_contents = git_contents(
+        root, [(base, path) for status, path in changed if status != 'A'])
+    if new:
+        new_contents = git_contents(
+            root, [(new, path) for status, path in changed if status != 'D'])
+    else:
+        new_contents = []
+        for status, path in changed:
+            if status != 'D':
+                with open(os.path.join(root, path)) as f:
+                    new_contents.append(f.read())
+    base_contents = iter(base_contents)
+    new_contents = iter(new_contents)
+    for status, path in changed:
+        name = os.path.join(root, path)
+        before = after = {}
+        if status != 'A':
+            before = scan_source_file(name, engine, next(base_contents))[1]
+        if status != 'D':
+            after = scan_source_file(name, engine, next(new_contents))[1]
+        yield name, before, after
+
+
+def report_changes(added, removed, output_file):
+    """Report (module, reference) pairs added and removed, by module.
+
+    A module with an empty reference is the import of the module.
+    """
+    for module in sorted(set(module for module, _ in added | removed)):
+        if (module, '') in added:
+            module += ' (added)'
+        elif (module, '') in removed:
+            module += ' (removed)'
+        print("    " + module, file=output_file)
+        module = module.split()[0]
+        for sign, pairs in (('+', added), ('-', removed)):
+            for ref in sorted(r for m, r in pairs if m == module and r):
+                print("        %s %s" % (sign, ref), file=output_file)
+
+
+def git_diff_references(args, output_file):
+    """Report the references added and removed by the changes in a range.
+
+    The references in the changed files at the base revision are compared
+    with those in the new revision, for each file and in total.
+    """
+    before_all = set()
+    after_all = set()
+    num_files = num_changed = 0
+    for root in args.roots:
+        for name, before, after in gen_git_diff_scan(root, args.git_diff,
+                                                     args.engine):
+            num_files += 1
+            before = module_references(before)
+            after = module_references(after)
+            before_all |= before
+            after_all |= after
+            if before == after:
+                continue
+            num_changed += 1
+            print("Changes for", name, file=output_file)
+            report_changes(after - before, before - after, output_file)
+    print("%d files changed, %d with changes to references" %
+          (num_files, num_changed), file=output_file)
+    if args.summary:
+        print('\n\n', file=output_file)
+        print("Summary of neutron import usage changes", file=output_file)
+        report_changes(after_all - before_all, before_all - after_all,
+                       output_file)
+
+
+def merge_references(all_references, imported_modules):
+    """Merge the modules used by a file, into those used by all files."""
+    for module in imported_modules.values():
+        if module.dotted_name in all_references:
+            all_references[module.dotted_name].refs |= module.refs
+        else:
+            all_references[module.dotted_name] = NeutronModule.from_report(
+                module.dotted_name, module.name, module.refs)
+
+
+class Summary(object):
+
+    """Modules and references used by all files, and under each root.
+
+    With one root, there is only the summary for all files. With several,
+    there is also a summary for each root, which comes before the combined
+    summary in the output. With -o, the summaries for each root are written
+    to their own files, named with the root's directory name (e.g.
+    refs-neutron_vpnaas.summary), so they can be merged like any other.
+
+    When counted (for watch mode), the number of files using each module
+    and reference is kept, so that a file's results can be removed again
+    without rebuilding the summary from every file.
+    """
+
+    def __init__(self, roots, counted=False):
+        self.roots = roots
+        self.all_references = {}
+        if len(roots) > 1:
+            self.root_references = collections.OrderedDict(
+                (root, {}) for root in roots)
+        else:
+            self.root_references = None
+        # Keyed by (root, module dotted name, reference), with a reference
+        # of None for the module itself, and root of None for all files
+        self.counts = collections.Counter() if counted else None
+
+    def root_of(self, name):
+        for root in self.roots:
+            if name.startswith(os.path.join(root, '')):
+                return root
+
+    def gen_groups(self, name):
+        """Yield the references for all files, and for the file's root."""
+        yield None, self.all_references
+        if self.root_references is not None:
+            root = self.root_of(name)
+            yield root, self.root_references[root]
+
+    def add(self, name, imported_modules):
+        for root, references in self.gen_groups(name):
+            merge_references(references, imported_modules)
+            if self.counts is None:
+                continue
+            for module in imported_modules.values():
+                self.counts[root, module.dotted_name, None] += 1
+                for ref in module.refs:
+                    self.counts[root, module.dotted_name, ref] += 1
+
+    def remove(self, name, imported_modules):
+        """Remove a file's results, which were added (when counted)."""
+        counts = self.counts
+        for root, references in self.gen_groups(name):
+            for module in imported_modules.values():
+                dotted_name = module.dotted_name
+                for ref in module.refs:
+                    key = (root, dotted_name, ref)
+                    counts[key] -= 1
+                    if not counts[key]:
+                        del counts[key]
+                        references[dotted_name].refs.discard(ref)
+                key = (root, dotted_name, None)
+                counts[key] -= 1
+                if not counts[key]:
+                    del counts[key]
+                    del references[dotted_name]
+
+    def labels(self):
+        """Unique names for the roots, from their directory names."""
+        labels = collections.OrderedDict()
+        for root in self.roots:
+            label = base = os.path.basename(os.path.abspath(root)) or 'root'
+            suffix = 1
+            while label in labels.values():
+                suffix += 1
+                label = '%s-%d' % (base, suffix)
+            labels[root] = label
+        return labels
+
+    def write(self, args, output_file, report=report_modules):
+        summaries = []
+        if self.root_references is not None:
+            labels = self.labels()
+            summaries = [(' in ' + root, '-' + labels[root], references)
+                         for root, references in
+                         self.root_references.items()]
+        summaries.append(('', '', self.all_references))
+        if not args.output:
+            print('\n\n', file=output_file)
+        for title, suffix, references in summaries:
+            if args.output:
+                with open(args.output + suffix + '.summary', 'w') as f:
+                    print("Summary of neutron import usage" + title, file=f)
+                    report(references, f)
+                write_summary_jsonl(references,
+                                    args.output + suffix + '.summary.jsonl')
+            else:
+                print("Summary of neutron import usage" + title,
+                      file=output_file)
+                report(references, output_file)
+
+
+class DependencyGraph(object):
+
+    """Imports between target modules, for transitive footprints.
+
+    Each target module is scanned once, for the target modules that it
+    imports, and the closure of each module (the modules it imports,
+    directly or indirectly) is memoized, so that the footprints of several
+    roots share the work. Modules are named by path, as in the summary, and
+    packages are scanned through their __init__.py.
+    """
+
+    def __init__(self, scan=gen_scan):
+        self.scan = scan
+        self.imports = {}
+        self.closures = {}
+
+    @staticmethod
+    def source_file(name):
+        path = os.path.join(target_base(name), name)
+        if name.endswith('.py'):
+            return path
+        return os.path.join(path, '__init__.py')
+
+    def load(self, names):
+        """Scan the modules not scanned yet, and the modules they import.
+
+        Modules are scanned a level at a time, so that each level can be
+        scanned by the pool, or found in the scan cache.
+        """
+        frontier = set(names) - set(self.imports)
+        while frontier:
+            sources = {}
+            for name in frontier:
+                source = self.source_file(name)
+                if os.path.isfile(source):
+                    sources[source] = name
+                else:
+                    self.imports[name] = frozenset()
+            for source, imported_modules in self.scan(sorted(sources)):
+                name = sources[source]
+                self.imports[name] = frozenset(
+                    module.name for module in imported_modules.values()
+                    if module.name != name)
+            frontier = set(child for name in sources.values()
+                           for child in self.imports[name])
+            frontier.difference_update(self.imports)
+
+    def closure(self, name):
+        """Modules that the module imports, directly or indirectly."""
+        if name not in self.closures:
+            self.load([name])
+            self.find_closures(name)
+        return self.closures[name]
+
+    def find_closures(self, start):
+        """Find closures of modules reachable from start, not yet found.
+
+        Imports can be circular, so the strongly connected components are
+        found (with Tarjan's algorithm, iteratively), and the modules in
+        each component share one closure.
+        """
+        index = {start: 0}
+        low = {start: 0}
+        stack = [start]
+        on_stack = set(stack)
+        work = [(start, iter(self.imports[start]))]
+        while work:
+            name, children = work[-1]
+            for child in children:
+                if child in self.closures:
+                    continue
+                if child not in index:
+                    index[child] = low[child] = len(index)
+                    stack.append(child)
+                    on_stack.add(child)
+                    work.append((child, iter(self.imports[child])))
+                    break
+                if child in on_stack:
+                    low[name] = min(low[name], index[child])
+            else:
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    low[parent] = min(low[parent], low[name])
+                if low[name] == index[name]:
+                    component = set()
+                    while name not in component:
+                        member = stack.pop()
+                        on_stack.discard(member)
+                        component.add(member)
+                    reached = set(component) if len(component) > 1 else set()
+                    for member in component:
+                        for child in self.imports[member] - component:
+                            reached.add(child)
+                            reached |= self.closures[child]
+                    closure = frozenset(reached)
+                    for member in component:
+                        self.closures[member] = closure
+
+    def footprint(self, direct):
+        """Modules used directly, and the modules they import."""
+        modules = set(direct)
+        for name in direct:
+            modules |= self.closure(name)
+        return modules
+
+    def fan_in(self, modules):
+        """Number of the modules that import each module."""
+        counts = collections.Counter()
+        for name in modules:
+            counts.update(self.imports[name])
+        return counts
+
+
+def report_footprint(graph, direct, title, output_file):
+    modules = graph.footprint(direct)
+    fan_in = graph.fan_in(modules)
+    print("Transitive neutron footprint%s (%d modules, %d used directly)" %
+          (title, len(modules), len(direct)), file=output_file)
+    for name in sorted(modules):
+        print("    %s (%sfan-in %d, fan-out %d)" %
+              (name, 'direct, ' if name in direct else '', fan_in[name],
+               len(graph.imports[name])), file=output_file)
+
+
+def write_footprints(graph, summary, args, output_file):
+    """Report the footprint for each root (if several), and for all roots.
+
+    With -o, the footprints are written to a file with a '.footprint'
+    suffix. With --graph, the graph of the footprint for all roots is saved
+    too, as DOT, if the file has a '.dot' suffix, or else JSON.
+    """
+    footprints = []
+    if summary.root_references is not None:
+        labels = summary.labels()
+        footprints = [(' in ' + root, labels[root], references)
+                      for root, references in summary.root_references.items()]
+    footprints.append(('', None, summary.all_references))
+    if args.output:
+        footprint_file = open(args.output + '.footprint', 'w')
+    else:
+        footprint_file = output_file
+        print('\n\n', file=output_file)
+    root_footprints = {}
+    for title, label, references in footprints:
+        direct = set(module.name for module in references.values())
+        report_footprint(graph, direct, title, footprint_file)
+        if label is not None:
+            root_footprints[label] = sorted(graph.footprint(direct))
+    if args.output:
+        footprint_file.close()
+    if args.graph:
+        all_direct = set(module.name
+                         for module in summary.all_references.values())
+        export_graph(graph, all_direct, root_footprints, args.graph)
+
+
+def export_graph(graph, direct, root_footprints, filename):
+    modules = graph.footprint(direct)
+    fan_in = graph.fan_in(modules)
+    with open(filename, 'w') as f:
+        if filename.endswith('.dot'):
+            f.write('digraph footprint {\n')
+            for name in sorted(modules):
+                f.write('    "%s"%s;\n' %
+                        (name, ' [shape=box]' if name in direct else ''))
+                for child in sorted(graph.imports[name]):
+                    f.write('    "%s" -> "%s";\n' % (name, child))
+            f.write('}\n')
+            return
+        graph_dict = {'modules': [{'module': name,
+                                   'direct': name in direct,
+                                   'fan_in': fan_in[name],
+                                   'fan_out': len(graph.imports[name]),
+                                   'imports': sorted(graph.imports[name])}
+                                  for name in sorted(modules)]}
+        if root_footprints:
+            graph_dict['roots'] = root_footprints
+        json.dump(graph_dict, f, indent=2, sort_keys=True)
+
+
+def update_watched(watched, summary, changed, removed, args, output_file,
+                   cache=None, symbol_index=None, prefilter=None):
+    """Re-analyze changed files, and update the outputs for all files.
+
+    The analysis of each changed file is reported, and the summary (which
+    must be counted) and symbol index are updated, using only the old and
+    new results of the files changed. The scan cache is only updated in
+    memory, as saving it takes longer than the update, and is saved when
+    watching ends. Files are analyzed in this process, as a pool would take
+    longer to start than analyzing a few files.
+    """
+    for name in removed:
+        old_modules = watched.pop(name, None)
+        if old_modules is not None:
+            summary.remove(name, old_modules)
+        if cache:
+            cache.remove(name)
+        if symbol_index:
+            symbol_index.update_file(name, {})
+    if cache:
+        results = gen_cached_scan(changed, cache, 1, args.engine, prefilter)
+    else:
+        results = gen_scan(changed, 1, args.engine, prefilter)
+    for name, imported_modules in results:
+        print("Analysis for", name, file=output_file)
+        report_modules(imported_modules, output_file)
+        if symbol_index:
+            symbol_index.update_file(name, imported_modules)
+            for module in imported_modules.values():
+                module.locations = None
+        old_modules = watched.get(name)
+        if old_modules is not None:
+            summary.remove(name, old_modules)
+        summary.add(name, imported_modules)
+        watched[name] = imported_modules
+    if symbol_index:
+        symbol_index.commit()
+    if args.summary:
+        summary.write(args, output_file)
+    output_file.flush()
+
+
+def watch_references(watcher, watched, summary, args, output_file,
+                     cache=None, symbol_index=None, prefilter=None):
+    """Poll for changes until interrupted, updating outputs for each."""
+    print("Watching %s for changes (Ctrl-C to stop)" %
+          ', '.join(args.roots), file=sys.stderr)
+    try:
+        while True:
+            time.sleep(args.interval)
+            changed, removed = watcher.poll()
+            if not changed and not removed:
+                continue
+            start = time.time()
+            update_watched(watched, summary, changed, removed, args,
+                           output_file, cache, symbol_index, prefilter)
+            print("Updated %d files, removed %d, in %.1f ms" %
+                  (len(changed), len(removed), (time.time() - start) * 1000),
+                  file=sys.stderr)
+    except KeyboardInterrupt:
+        pass
+
+
+def report_stats(stats, args, start):
+    """Output the stats for the run, and save them, as requested."""
+    stats.wall_time = time.time() - start
+    stats.peak_rss, stats.peak_rss_workers = peak_rss()
+    if args.stats:
+        stats.report(sys.stderr, args.slowest)
+    if args.stats_file:
+        with open(args.stats_file, 'w') as f:
+            json.dump(stats.as_dict(args.slowest), f, indent=2,
+                      sort_keys=True)
+
+
 def process_references(args):
+    global record_locations
     if args.output:
         output_file = open(args.output, 'w')
     else:
         output_file = sys.stdout
 
-    files = gen_find("*.py", args.root)
-    all_references = {}
-    for f in files:
-        source_scan = SourceScanner(f, output_file)
-        source_scan.analyze()
-        source_scan.report_for_source_module()
-        for module in source_scan.imported_modules.values():
-            if module.dotted_name in all_references:
-                all_references[module.dotted_name].refs |= module.refs
-            else:
-                all_references[module.dotted_name] = module
-    if args.summary:
+    start = time.time()
+    report = report_modules
+    if args.targets:
+        set_targets(args.targets)
+    if args.excludes or args.gitignore:
+        ignore = IgnoreRules(args.excludes or (), args.gitignore)
+    else:
+        ignore = None
+    if args.watch:
+        # Snapshot the tree before scanning it, so no change is missed
+        watcher = TreeWatcher("*.py", args.roots, ignore)
+        watched = SpilledResults(args.spill) if args.spill else {}
+    if args.stats or args.stats_file:
+        stats = enable_stats()
+        index = stats.timed('index', load_neutron_index)(args.index_cache)
+        files = stats.gen_timed('walk',
+                                gen_find_roots("*.py", args.roots, ignore))
+        report = stats.timed('report', report_modules)
+    else:
+        stats = None
+        index = load_neutron_index(args.index_cache)
+        files = gen_find_roots("*.py", args.roots, ignore)
+    if args.engine == 'compare':
+        compare_engines(files, output_file)
+        if stats:
+            report_stats(stats, args, start)
         if args.output:
             output_file.close()
-            output_file = open(args.output + '.summary', 'w')
+        return
+    if args.git_diff:
+        git_diff_references(args, output_file)
+        return
+    prefilter = Prefilter(args.engine) if args.prefilter else None
+    if args.db:
+        record_locations = True
+        symbol_index = SymbolIndex(args.db)
+        files = list(files)
+    else:
+        symbol_index = None
+    if args.scan_cache:
+        cache = ScanCache.load(args.scan_cache,
+                               args.engine + ':' + index.fingerprint())
+        results = gen_cached_scan(files, cache, args.jobs, args.engine,
+                                  prefilter)
+    else:
+        cache = None
+        results = gen_scan(files, args.jobs, args.engine, prefilter)
+    summary = Summary(args.roots, counted=args.watch)
+    for name, imported_modules in results:
+        print("Analysis for", name, file=output_file)
+        report(imported_modules, output_file)
+        if symbol_index:
+            symbol_index.update_file(name, imported_modules)
+            for module in imported_modules.values():
+                module.locations = None
+        summary.add(name, imported_modules)
+        if args.watch:
+            watched[name] = imported_modules
+    if args.footprint or args.graph:
+        # Target modules are scanned like the source files, with the cache
+        if cache:
+            scan = functools.partial(gen_cached_scan, cache=cache,
+                                     jobs=args.jobs, engine=args.engine)
         else:
-            print('\n\n', file=output_file)
-        print("Summary of neutron import usage", file=output_file)
-        report_modules(all_references, output_file)
+            scan = functools.partial(gen_scan, jobs=args.jobs,
+                                     engine=args.engine)
+        graph = DependencyGraph(scan)
+        if stats:
+            graph.load = stats.timed('footprint', graph.load)
+        graph.load(set(module.name for module in
+                       summary.all_references.values()))
+    if cache:
+        cache.save(args.scan_cache, args.roots)
+    if symbol_index:
+        for root in args.roots:
+            symbol_index.remove_missing(root, files)
+        symbol_index.commit()
+    if prefilter:
+        prefilter.report(sys.stderr)
+    if args.summary:
+        summary.write(args, output_file, report)
+    if args.footprint or args.graph:
+        write_footprints(graph, summary, args, output_file)
+    if stats:
+        report_stats(stats, args, start)
+    if args.watch:
+        watch_references(watcher, watched, summary, args, output_file,
+                         cache, symbol_index, prefilter)
+        if cache:
+            cache.save(args.scan_cache, args.roots)
+        if args.spill:
+            watched.close()
+    if symbol_index:
+        symbol_index.close()
+    if args.output:
+        output_file.close()
 
 
-if __name__ == '__main__':
+def target_type(value):
+    package, sep, base = value.partition('=')
+    if not (sep and base and identifier_re.match(package)):
+        raise argparse.ArgumentTypeError(
+            "'%s' is not PACKAGE=DIR (e.g. neutron_lib=/opt/stack/neutron-lib)"
+            % value)
+    return package, base
+
+
+def jobs_type(value):
+    try:
+        jobs = int(value)
+    except ValueError:
+        jobs = 0
+    if jobs < 1:
+        raise argparse.ArgumentTypeError(
+            "'%s' is not a number of processes (1 or more)" % value)
+    return jobs
+
+
+def create_parser():
     parser = argparse.ArgumentParser(description='Determine dependencies')
     parser.add_argument('-o', '--output', dest='output', action='store',
                         help='Redirect detailed output to file specified')
     parser.add_argument('-s', '--summary', dest='summary', action='store_true',
                         help='Generate summary output too')
-    parser.add_argument(dest='root', nargs='?', default='.',
-                       help='Starting point for scanning')
-    args = parser.parse_args()
+    parser.add_argument('--target', dest='targets', action='append',
+                        type=target_type, metavar='PACKAGE=DIR',
+                        help='Package to report the use of, and the directory '
+                        'it is in. Repeat for each package (default is '
+                        'neutron=%s)' % NEUTRON_BASE)
+    parser.add_argument('--exclude', dest='excludes', action='append',
+                        metavar='PATTERN',
+                        help='Glob for files and directories to leave out, '
+                        'matching the name or path from the root (e.g. .tox). '
+                        'Repeat for each pattern')
+    parser.add_argument('--gitignore', dest='gitignore', action='store_true',
+                        help='Leave out files and directories ignored by '
+                        '.gitignore files, and .git')
+    parser.add_argument('--index-cache', dest='index_cache', action='store',
+                        help='File to save the index of Neutron modules in, '
+                        'and reuse it from while the Neutron tree is '
+                        'unchanged')
+    parser.add_argument('--scan-cache', dest='scan_cache', action='store',
+                        help='File to save scan results in, so that only '
+                        'files changed since the last run are analyzed')
+    parser.add_argument('-j', '--jobs', dest='jobs', action='store',
+                        nargs='?', type=jobs_type, default=1, const=0,
+                        help='Number of processes to scan files with '
+                        '(one per CPU, if no number is given)')
+    parser.add_argument('--engine', dest='engine', action='store',
+                        choices=('regex', 'ast', 'compare'), default='regex',
+                        help='Parse source with regexes, or syntax trees, or '
+                        'compare the results and times of both')
+    parser.add_argument('--prefilter', dest='prefilter', action='store_true',
+                        help='Skip parsing files that have no Neutron '
+                        'imports, reporting the files and bytes skipped')
+    parser.add_argument('--db', dest='db', action='store',
+                        help='SQLite database file to record the location of '
+                        'each import and usage in, for query.py')
+    parser.add_argument('--git-diff', dest='git_diff', action='store',
+                        metavar='REVISIONS',
+                        help='Only analyze Python files changed in the git '
+                        'revisions (e.g. HEAD~1..HEAD, origin/master...HEAD, '
+                        'or HEAD for uncommitted changes), reporting the '
+                        'references added and removed')
+    parser.add_argument('--footprint', dest='footprint', action='store_true',
+                        help='Also scan the Neutron modules used, to report '
+                        'all the modules they import, directly or indirectly, '
+                        'with the fan-in and fan-out of each')
+    parser.add_argument('--graph', dest='graph', action='store',
+                        metavar='FILE',
+                        help='Save the import graph of the footprint to file, '
+                        'as DOT if it ends in .dot, else as JSON (implies '
+                        '--footprint)')
+    parser.add_argument('--watch', dest='watch', action='store_true',
+                        help='After scanning, keep polling for changed files, '
+                        'analyzing them and updating the outputs')
+    parser.add_argument('--interval', dest='interval', action='store',
+                        type=float, default=1.0,
+                        help='Seconds between polls for changes, in watch '
+                        'mode')
+    parser.add_argument('--spill', dest='spill', action='store',
+                        metavar='DIR',
+                        help='In watch mode, keep the results for each file '
+                        'in a temporary file in DIR, rather than in memory')
+    parser.add_argument('--stats', dest='stats', action='store_true',
+                        help='Report time per phase and work done, on stderr')
+    parser.add_argument('--stats-file', dest='stats_file', action='store',
+                        help='Write the statistics to file specified, as JSON')
+    parser.add_argument('--slowest', dest='slowest', action='store',
+                        type=int, default=10,
+                        help='Number of slowest files to list in statistics')
+    parser.add_argument('--profile', dest='profile', action='store',
+                        help='Run under cProfile, saving the profile data to '
+                        'file specified')
+    parser.add_argument(dest='roots', metavar='root', nargs='*', default=['.'],
+                        help='Starting points for scanning (e.g. several '
+                        'projects, which share the Neutron index and caches)')
+    return parser
+
 
-    process_references(args)
+if __name__ == '__main__':
+    parser = create_parser()
+    args = parser.parse_args()
+    if args.watch and args.engine == 'compare':
+        parser.error('--watch cannot be used with --engine compare')
+    if args.git_diff and (args.watch or args.engine == 'compare'):
+        parser.error('--git-diff cannot be used with --watch or '
+                     '--engine compare')
+    try:
+        if args.profile:
+            cProfile.run('process_references(args)', args.profile)
+        else:
+            process_references(args)
+    except GitCommandFailed as e:
+        sys.exit(e.msg)
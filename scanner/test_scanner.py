@@ -1,4 +1,8 @@
+import json
 import os
+import pickle
+import shutil
+import tempfile
 
 
 import mock
@@ -167,6 +171,107 @@ class TestImportUsage(base.BaseTestCase):
         self.source_scanner.find_import_usage("  not_y1.x = yy1.z + x.y1.t")
         self.assertEqual(set(), self.module.refs)
 
+    def test_found_multiple_aliases(self):
+        self.source_scanner.add_import('y', 'neutron.x.z')
+        other = self.source_scanner.imported_modules['neutron.x.z']
+        self.source_scanner.find_import_usage("    y1.a(y.b, y1.c(y.d))")
+        self.assertEqual(set(['a', 'c']), self.module.refs)
+        self.assertEqual(set(['b', 'd']), other.refs)
+
+    def test_found_alias_added_after_usage(self):
+        self.source_scanner.find_import_usage("    y1.a = y2.b")
+        self.source_scanner.add_import('y2', 'neutron.x.z')
+        self.source_scanner.find_import_usage("    y1.c = y2.d")
+        other = self.source_scanner.imported_modules['neutron.x.z']
+        self.assertEqual(set(['a', 'c']), self.module.refs)
+        self.assertEqual(set(['d']), other.refs)
+
+    def test_usage_regex_shared_across_files(self):
+        another_scanner = scanner.SourceScanner('other.py')
+        another_scanner.add_import('y1', 'neutron.x.y')
+        self.source_scanner.build_usage_matcher()
+        another_scanner.build_usage_matcher()
+        self.assertIs(self.source_scanner.usage_regex,
+                      another_scanner.usage_regex)
+
+
+class TestAstEngine(base.BaseTestCase):
+
+    def setUp(self):
+        super(TestAstEngine, self).setUp()
+        mock.patch.object(os.path, 'isfile', return_value=True).start()
+        mock.patch.object(os.path, 'isdir', return_value=False).start()
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+
+    def analyze(self, content):
+        name = os.path.join(self.root, 'source.py')
+        with open(name, 'w') as f:
+            f.write(content)
+        source_scanner = scanner.SourceScanner(name)
+        self.assertTrue(source_scanner.analyze_ast())
+        return dict((module.name, module.refs)
+                    for module in source_scanner.imported_modules.values())
+
+    def test_imports_and_usage(self):
+        content = """import neutron.x.y1
+import neutron.x.y2 as y
+from neutron.w import z1, z2 as z
+from neutron.i18n import _LE
+
+def f(a):
+    y1.bar(y.some_object.some_attr, {z1.C: z.get_client().cast})
+    return y1.items[a], z.Error(_LE("x"))
+"""
+        self.assertEqual({'neutron/x/y1.py': set(['bar', 'items']),
+                          'neutron/x/y2.py': set(['some_object.some_attr']),
+                          'neutron/w/z1.py': set(['C']),
+                          'neutron/w/z2.py': set(['get_client', 'Error']),
+                          'neutron/i18n/_LE.py': set()},
+                         self.analyze(content))
+
+    def test_multiline_import(self):
+        content = """from neutron.x import (
+    y1,
+    y2 as y,
+    y3
+)
+y1.a, y.b, y3.c
+"""
+        self.assertEqual({'neutron/x/y1.py': set(['a']),
+                          'neutron/x/y2.py': set(['b']),
+                          'neutron/x/y3.py': set(['c'])},
+                         self.analyze(content))
+
+    def test_usage_before_import_and_in_strings_ignored(self):
+        content = """y1.a = 1
+from neutron.x import y1
+# y1.b in a comment
+c = "y1.d in a string"
+not_y1.e = y1.f
+"""
+        self.assertEqual({'neutron/x/y1.py': set(['f'])},
+                         self.analyze(content))
+
+    def test_usage_follows_rebound_alias(self):
+        content = """from neutron.x import y1
+y1.a
+from neutron.w import y2 as y1
+y1.b
+"""
+        self.assertEqual({'neutron/x/y1.py': set(['a']),
+                          'neutron/w/y2.py': set(['b'])},
+                         self.analyze(content))
+
+    def test_null_bytes_use_regex_engine(self):
+        name = os.path.join(self.root, 'source.py')
+        with open(name, 'w') as f:
+            f.write("from neutron.x import y1\ndef f():\n    y1.a('\0')\n")
+        source_scanner = scanner.SourceScanner(name)
+        self.assertFalse(source_scanner.analyze_ast())
+        self.assertEqual(set(['a']), source_scanner.imported_modules[
+            'neutron.x.y1'].refs)
+
 
 class TestImportDetection(base.BaseTestCase):
 
@@ -250,6 +355,674 @@ class TestImportDetection(base.BaseTestCase):
                          modules[expected_module].refs)
 
 
+class TestNeutronIndex(base.BaseTestCase):
+
+    def setUp(self):
+        super(TestNeutronIndex, self).setUp()
+        self.base = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.base)
+        os.makedirs(os.path.join(self.base, 'neutron', 'common'))
+        os.makedirs(os.path.join(self.base, '.git'))
+        for name in ('neutron/__init__.py', 'neutron/i18n.py',
+                     'neutron/common/config.py', 'neutron/README'):
+            open(os.path.join(self.base, name), 'w').close()
+        self.index = scanner.NeutronIndex.build(self.base)
+
+    def test_index_packages_and_modules(self):
+        self.assertTrue(self.index.isdir('neutron/common'))
+        self.assertFalse(self.index.isdir('neutron/i18n'))
+        self.assertFalse(self.index.isdir('.git'))
+        self.assertTrue(self.index.isfile('neutron/i18n.py'))
+        self.assertTrue(self.index.isfile('neutron/common/config.py'))
+        self.assertFalse(self.index.isfile('neutron/README'))
+        self.assertFalse(self.index.isfile('neutron/common.py'))
+
+    def test_resolve_from_index_without_filesystem(self):
+        mock.patch.object(scanner, 'neutron_index', self.index).start()
+        isfile = mock.patch.object(os.path, 'isfile').start()
+        isdir = mock.patch.object(os.path, 'isdir').start()
+        module = scanner.NeutronModule('neutron.i18n._LE')
+        self.assertEqual('neutron/i18n.py', module.name)
+        self.assertEqual(set(['_LE']), module.refs)
+        module = scanner.NeutronModule('neutron.common')
+        self.assertEqual('neutron/common', module.name)
+        self.assertRaises(scanner.NeutronModuleNotFound,
+                          scanner.NeutronModule, 'neutron.foo.bar')
+        self.assertFalse(isfile.called)
+        self.assertFalse(isdir.called)
+
+    def test_saved_index_reused_until_tree_changes(self):
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        cache_file = os.path.join(cache_dir, 'index.json')
+        self.index.save(cache_file)
+        index = scanner.NeutronIndex.load(cache_file)
+        self.assertTrue(index.is_current(self.base))
+        self.assertEqual(self.index.modules, index.modules)
+        self.assertEqual(self.index.dirs, index.dirs)
+        self.assertFalse(index.is_current('/some/other/tree'))
+        index.dirs['neutron/common'] -= 1
+        self.assertFalse(index.is_current(self.base))
+
+    def test_saved_index_keyed_by_git_head(self):
+        with open(os.path.join(self.base, '.git', 'HEAD'), 'w') as f:
+            f.write('1234abcd\n')
+        index = scanner.NeutronIndex.build(self.base)
+        self.assertEqual('1234abcd', index.head)
+        self.assertTrue(index.is_current(self.base))
+        with open(os.path.join(self.base, '.git', 'HEAD'), 'w') as f:
+            f.write('5678abcd\n')
+        self.assertFalse(index.is_current(self.base))
+
+
+class TestTargets(base.BaseTestCase):
+
+    def setUp(self):
+        super(TestTargets, self).setUp()
+        self.addCleanup(scanner.set_targets, list(scanner.targets.items()))
+        self.lib_base = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.lib_base)
+        os.makedirs(os.path.join(self.lib_base, 'neutron_lib', 'api'))
+        for name in ('neutron_lib/__init__.py', 'neutron_lib/constants.py',
+                     'neutron_lib/api/validators.py'):
+            open(os.path.join(self.lib_base, name), 'w').close()
+        scanner.set_targets([('neutron', scanner.NEUTRON_BASE),
+                             ('neutron_lib', self.lib_base)])
+
+    def test_parse_imports_of_all_targets(self):
+        lines = ["from neutron_lib.api import validators as v\n",
+                 "import neutron.i18n\n",
+                 "import neutron_other.x\n",
+                 "from neutron_lib.api import (\n",
+                 "    validators)\n"]
+        self.assertEqual(
+            [(True, 'neutron_lib.api.validators', 'v'),
+             (True, 'neutron.i18n', 'i18n'),
+             (False, 'import neutron_other.x\n', None),
+             (True, 'neutron_lib.api.validators', 'validators')],
+            list(scanner.gen_parse(lines)))
+
+    def test_modules_resolved_in_target_directories(self):
+        for index in (None, scanner.load_neutron_index()):
+            scanner.neutron_index = index
+            module = scanner.NeutronModule('neutron_lib.constants.PORT')
+            self.assertEqual('neutron_lib/constants.py', module.name)
+            self.assertEqual(set(['PORT']), module.refs)
+            module = scanner.NeutronModule('neutron.i18n')
+            self.assertEqual('neutron/i18n.py', module.name)
+            self.assertRaises(scanner.NeutronModuleNotFound,
+                              scanner.NeutronModule, 'neutron_lib.i18n')
+
+    def test_one_pass_for_all_targets(self):
+        source = os.path.join(self.lib_base, 'source.py')
+        with open(source, 'w') as f:
+            f.write("from neutron_lib.api import validators\n"
+                    "from neutron.i18n import _LE\n"
+                    "    validators.validate_uuid(_LE('x'))\n")
+        for engine in ('regex', 'ast'):
+            self.assertTrue(scanner.Prefilter(engine).may_import(source))
+            _, modules = scanner.scan_source_file(source, engine)
+            self.assertEqual(set(['validate_uuid']),
+                             modules['neutron_lib.api.validators'].refs)
+            self.assertEqual(set(['_LE']), modules['neutron.i18n'].refs)
+
+
+class TestScanning(base.BaseTestCase):
+
+    """Note: Tests in this class require real modules."""
+
+    def setUp(self):
+        super(TestScanning, self).setUp()
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        self.files = []
+        for i in range(20):
+            name = os.path.join(self.root, 'source%d.py' % i)
+            with open(name, 'w') as f:
+                f.write("from neutron.common import config\n"
+                        "from neutron.i18n import _LE\n"
+                        "    config.setup_logging(x%d)\n"
+                        "    config.opt%d = _LE('x')\n" % (i, i))
+            self.files.append(name)
+
+    def test_scan_file(self):
+        name, modules = scanner.scan_source_file(self.files[3])
+        self.assertEqual(self.files[3], name)
+        self.assertEqual(set(['neutron.common.config', 'neutron.i18n']),
+                         set(modules))
+        self.assertEqual(set(['setup_logging', 'opt3']),
+                         modules['neutron.common.config'].refs)
+        self.assertEqual(set(['_LE']), modules['neutron.i18n'].refs)
+
+    def test_parallel_scan_matches_serial_scan(self):
+        serial = list(scanner.gen_scan(self.files))
+        parallel = list(scanner.gen_scan(self.files, jobs=3))
+        self.assertEqual([name for name, modules in serial],
+                         [name for name, modules in parallel])
+        for (_, expected), (_, actual) in zip(serial, parallel):
+            self.assertEqual(sorted(expected), sorted(actual))
+            for module_name in expected:
+                self.assertEqual(expected[module_name].refs,
+                                 actual[module_name].refs)
+
+    def test_stats_for_scan(self):
+        self.addCleanup(scanner.disable_stats)
+        stats = scanner.enable_stats()
+        list(scanner.gen_scan(self.files[:2]))
+        self.assertEqual(2, stats.counters['files'])
+        self.assertEqual(8, stats.counters['lines'])
+        self.assertEqual(4, stats.counters['resolve_calls'])
+        self.assertEqual(4, stats.counters['match_calls'])
+        self.assertTrue(stats.counters['regex_evaluations'])
+        self.assertEqual(sum(os.path.getsize(f) for f in self.files[:2]),
+                         stats.counters['bytes'])
+        self.assertEqual(set(self.files[:2]),
+                         set(name for name, secs in
+                             stats.as_dict(slowest=5)['slowest_files']))
+
+    def test_stats_from_worker_processes(self):
+        self.addCleanup(scanner.disable_stats)
+        stats = scanner.enable_stats()
+        list(scanner.gen_scan(self.files, jobs=3))
+        self.assertEqual(20, stats.counters['files'])
+        self.assertEqual(20, len(set(name for secs, name in
+                                     stats.file_times)))
+
+    def test_compare_engines_writes_stats_and_output(self):
+        self.addCleanup(scanner.disable_stats)
+        output = os.path.join(self.root, 'refs')
+        stats_file = os.path.join(self.root, 'stats.json')
+        args = scanner.create_parser().parse_args(
+            ['--engine', 'compare', '-o', output, '--stats-file', stats_file,
+             self.root])
+        scanner.process_references(args)
+        with open(output) as f:
+            self.assertIn('Compared 20 files, 0 with differences', f.read())
+        with open(stats_file) as f:
+            self.assertIn('wall_time', json.load(f))
+
+    def test_prefilter_skips_files_without_imports(self):
+        name = os.path.join(self.root, 'plain.py')
+        with open(name, 'w') as f:
+            f.write("import os\n# neutron.x is not imported\n")
+        prefilter = scanner.Prefilter()
+        results = list(scanner.gen_scan([name] + self.files[:2],
+                                        prefilter=prefilter))
+        self.assertEqual((name, {}), results[0])
+        self.assertEqual(set(['neutron.common.config', 'neutron.i18n']),
+                         set(results[1][1]))
+        self.assertEqual(3, prefilter.files_checked)
+        self.assertEqual(1, prefilter.files_skipped)
+        self.assertEqual(os.path.getsize(name), prefilter.bytes_skipped)
+
+    def test_prefilter_for_engine(self):
+        name = os.path.join(self.root, 'local_import.py')
+        with open(name, 'w') as f:
+            f.write("def f():\n    from neutron.common import config\n")
+        self.assertFalse(scanner.Prefilter('regex').may_import(name))
+        self.assertTrue(scanner.Prefilter('ast').may_import(name))
+
+    def test_cached_scan_only_analyzes_changed_files(self):
+        cache_file = os.path.join(self.root, 'cache.json')
+        cache = scanner.ScanCache.load(cache_file, 'fingerprint')
+        expected = list(scanner.gen_cached_scan(self.files, cache))
+        cache.save(cache_file)
+        self.assertEqual(20, cache.misses)
+        with open(self.files[5], 'a') as f:
+            f.write("    config.another_opt = 1\n")
+
+        cache = scanner.ScanCache.load(cache_file, 'fingerprint')
+        actual = list(scanner.gen_cached_scan(self.files, cache))
+        self.assertEqual(19, cache.hits)
+        self.assertEqual(1, cache.misses)
+        expected[5] = scanner.scan_source_file(self.files[5])
+        self.assertEqual([name for name, modules in expected],
+                         [name for name, modules in actual])
+        for (_, expected_modules), (_, modules) in zip(expected, actual):
+            for module_name, module in expected_modules.items():
+                self.assertEqual(module.name, modules[module_name].name)
+                self.assertEqual(module.refs, modules[module_name].refs)
+        self.assertIn('another_opt',
+                      actual[5][1]['neutron.common.config'].refs)
+
+    def test_cache_shared_by_runs_keeps_entries(self):
+        cache_file = os.path.join(self.root, 'cache.json')
+        for files in (self.files[:10], self.files[10:]):
+            cache = scanner.ScanCache.load(cache_file, 'fingerprint')
+            list(scanner.gen_cached_scan(files, cache))
+            cache.save(cache_file, [self.root])
+        os.remove(self.files[0])
+        cache = scanner.ScanCache.load(cache_file, 'fingerprint')
+        list(scanner.gen_cached_scan(self.files[1:10], cache))
+        cache.save(cache_file, [self.root])
+
+        cache = scanner.ScanCache.load(cache_file, 'fingerprint')
+        self.assertNotIn(os.path.abspath(self.files[0]), cache.entries)
+        list(scanner.gen_cached_scan(self.files[1:], cache))
+        self.assertEqual(19, cache.hits)
+        self.assertEqual(0, cache.misses)
+
+    def test_cache_discarded_when_neutron_tree_changes(self):
+        cache_file = os.path.join(self.root, 'cache.json')
+        cache = scanner.ScanCache.load(cache_file, 'fingerprint')
+        list(scanner.gen_cached_scan(self.files, cache))
+        cache.save(cache_file)
+        cache = scanner.ScanCache.load(cache_file, 'other-fingerprint')
+        list(scanner.gen_cached_scan(self.files, cache))
+        self.assertEqual(0, cache.hits)
+
+
+class TestFind(base.BaseTestCase):
+
+    def setUp(self):
+        super(TestFind, self).setUp()
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        for name in ('.git/hooks/hook.py', '.tox/py27/lib/t.py', 'a.py',
+                     'gen.py', 'pkg/b.py', 'pkg/build/c.py', 'pkg/sub/d.py',
+                     'pkg/sub/gen.py', 'README'):
+            name = os.path.join(self.root, name)
+            if not os.path.isdir(os.path.dirname(name)):
+                os.makedirs(os.path.dirname(name))
+            open(name, 'w').close()
+        with open(os.path.join(self.root, '.gitignore'), 'w') as f:
+            f.write("# Comment\n.tox/\nbuild\n/gen.py\n")
+        with open(os.path.join(self.root, 'pkg', '.gitignore'), 'w') as f:
+            f.write("sub/*.py\n!sub/d.py\n")
+
+    def find(self, ignore=None):
+        return sorted(os.path.relpath(name, self.root) for name in
+                      scanner.gen_find('*.py', self.root, ignore))
+
+    def test_find_all(self):
+        self.assertEqual(['.git/hooks/hook.py', '.tox/py27/lib/t.py', 'a.py',
+                          'gen.py', 'pkg/b.py', 'pkg/build/c.py',
+                          'pkg/sub/d.py', 'pkg/sub/gen.py'], self.find())
+
+    def test_excluded_directories_not_entered(self):
+        list_dir = mock.patch.object(scanner, 'list_dir',
+                                     side_effect=scanner.list_dir).start()
+        ignore = scanner.IgnoreRules(['.*', 'pkg/sub', 'gen.py'])
+        self.assertEqual(['a.py', 'pkg/b.py', 'pkg/build/c.py'],
+                         self.find(ignore))
+        listed = sorted(call[0][0] for call in list_dir.call_args_list)
+        self.assertEqual(sorted([self.root, os.path.join(self.root, 'pkg'),
+                                 os.path.join(self.root, 'pkg', 'build')]),
+                         listed)
+
+    def test_gitignore(self):
+        ignore = scanner.IgnoreRules(gitignore=True)
+        self.assertEqual(['a.py', 'pkg/b.py', 'pkg/sub/d.py'],
+                         self.find(ignore))
+        self.assertEqual(['pkg/sub/d.py'], [
+            os.path.relpath(name, self.root) for name in
+            scanner.gen_find('*.py', os.path.join(self.root, 'pkg', 'sub'),
+                             ignore)])
+
+
+class TestWatch(base.BaseTestCase):
+
+    """Note: Tests in this class require real modules."""
+
+    def setUp(self):
+        super(TestWatch, self).setUp()
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        self.files = [self.write_source('source%d.py' % i, 'opt%d' % i)
+                      for i in range(3)]
+        self.watcher = scanner.TreeWatcher('*.py', [self.root])
+
+    def write_source(self, name, ref):
+        name = os.path.join(self.root, name)
+        with open(name, 'w') as f:
+            f.write("from neutron.common import config\n"
+                    "    config.%s = 1\n" % ref)
+        return name
+
+    def touch(self, name):
+        """Move mtime back, as it may not change within the same tick."""
+        mtime = os.stat(name).st_mtime - 10
+        os.utime(name, (mtime, mtime))
+
+    def test_watcher_finds_changed_added_and_removed_files(self):
+        self.assertEqual(([], []), self.watcher.poll())
+        self.write_source('source0.py', 'changed')
+        self.touch(self.files[0])
+        os.mkdir(os.path.join(self.root, 'sub'))
+        added = self.write_source(os.path.join('sub', 'new.py'), 'new')
+        with open(os.path.join(self.root, 'notes.txt'), 'w') as f:
+            f.write('not source')
+        os.remove(self.files[2])
+        self.touch(self.root)
+        self.assertEqual((sorted([self.files[0], added]), [self.files[2]]),
+                         self.watcher.poll())
+        self.assertEqual(([], []), self.watcher.poll())
+
+    def test_update_watched_rewrites_summary(self):
+        output = os.path.join(self.root, 'refs')
+        args = scanner.create_parser().parse_args(
+            [self.root, '-s', '-o', output, '--watch'])
+        watched = dict(scanner.gen_scan(self.files))
+        summary = scanner.Summary(args.roots, counted=True)
+        for name, imported_modules in watched.items():
+            summary.add(name, imported_modules)
+        self.write_source('source0.py', 'changed')
+        with open(output, 'w') as output_file:
+            scanner.update_watched(watched, summary, [self.files[0]],
+                                   [self.files[2]], args, output_file)
+        with open(output) as f:
+            self.assertEqual("Analysis for %s\n"
+                             "    neutron/common/config.py\n"
+                             "        changed\n" % self.files[0], f.read())
+        with open(output + '.summary') as f:
+            self.assertEqual("Summary of neutron import usage\n"
+                             "    neutron/common/config.py\n"
+                             "        changed\n"
+                             "        opt1\n", f.read())
+
+
+class TestGitDiff(base.BaseTestCase):
+
+    """Note: Tests in this class require real modules, and git."""
+
+    def setUp(self):
+        super(TestGitDiff, self).setUp()
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        for var in ('GIT_AUTHOR_NAME', 'GIT_COMMITTER_NAME'):
+            mock.patch.dict(os.environ, {var: 'tester'}).start()
+        for var in ('GIT_AUTHOR_EMAIL', 'GIT_COMMITTER_EMAIL'):
+            mock.patch.dict(os.environ, {var: 'tester@example.com'}).start()
+        scanner.git(['init', '-q'], self.root)
+        self.commit({'a.py': "from neutron.common import rpc\n"
+                             "from neutron.i18n import _LW\n"
+                             "    rpc.get_server(_LW)\n",
+                     'gone.py': "from neutron.common import config\n",
+                     'README': "not source\n"})
+        self.commit({'a.py': "from neutron.common import rpc\n"
+                             "    rpc.get_client()\n",
+                     'new.py': "from neutron.common import config\n"},
+                    removed=['gone.py'])
+
+    def commit(self, files, removed=()):
+        for name, contents in files.items():
+            with open(os.path.join(self.root, name), 'w') as f:
+                f.write(contents)
+        for name in removed:
+            os.remove(os.path.join(self.root, name))
+        scanner.git(['add', '-A', '.'], self.root)
+        scanner.git(['commit', '-q', '-m', 'Change'], self.root)
+
+    def changes(self, revisions):
+        return dict((os.path.basename(name),
+                     (scanner.module_references(before),
+                      scanner.module_references(after)))
+                    for name, before, after in
+                    scanner.gen_git_diff_scan(self.root, revisions))
+
+    def test_changed_files_before_and_after(self):
+        changes = self.changes('HEAD~1..HEAD')
+        self.assertEqual(['a.py', 'gone.py', 'new.py'], sorted(changes))
+        self.assertEqual(
+            (set([('neutron/common/rpc.py', ''),
+                  ('neutron/common/rpc.py', 'get_server'),
+                  ('neutron/i18n.py', ''), ('neutron/i18n.py', '_LW')]),
+             set([('neutron/common/rpc.py', ''),
+                  ('neutron/common/rpc.py', 'get_client')])),
+            changes['a.py'])
+        self.assertEqual(set(), changes['gone.py'][1])
+        self.assertEqual(set(), changes['new.py'][0])
+        self.assertEqual(changes, self.changes('HEAD~1...HEAD'))
+
+    def test_changes_in_working_tree(self):
+        with open(os.path.join(self.root, 'a.py'), 'a') as f:
+            f.write("    rpc.extra()\n")
+        changes = self.changes('HEAD')
+        self.assertEqual(['a.py'], list(changes))
+        before, after = changes['a.py']
+        self.assertEqual(set([('neutron/common/rpc.py', 'extra')]),
+                         after - before)
+
+    def test_bad_revision(self):
+        self.assertRaises(scanner.GitCommandFailed, list,
+                          scanner.gen_git_diff_scan(self.root, 'nosuch'))
+
+
+class TestSymbolIndex(base.BaseTestCase):
+
+    """Note: Tests in this class require real modules."""
+
+    def setUp(self):
+        super(TestSymbolIndex, self).setUp()
+        mock.patch.object(scanner, 'record_locations', True).start()
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        self.source = os.path.join(self.root, 'source.py')
+        with open(self.source, 'w') as f:
+            f.write("from neutron.common import config\n"
+                    "from neutron.i18n import _LE\n"
+                    "\n"
+                    "    config.setup_logging(_LE('x'))\n"
+                    "    x = [config.opt]\n")
+        self.index = scanner.SymbolIndex(':memory:')
+
+    def locations(self, imported_modules):
+        return dict((name, sorted(module.locations))
+                    for name, module in imported_modules.items())
+
+    def test_locations_recorded(self):
+        expected = {'neutron.common.config': [('', 1), ('opt', 5),
+                                              ('setup_logging', 4)],
+                    'neutron.i18n': [('', 2), ('_LE', 2)]}
+        for engine in ('regex', 'ast'):
+            _, modules = scanner.scan_source_file(self.source, engine)
+            self.assertEqual(expected, self.locations(modules))
+
+    def test_queries(self):
+        _, modules = scanner.scan_source_file(self.source)
+        self.index.update_file(self.source, modules)
+        rows = self.index.find_symbol('neutron.common.config.setup_logging')
+        self.assertEqual([('neutron.common.config',
+                           'neutron/common/config.py', 'setup_logging',
+                           'neutron.common.config.setup_logging',
+                           self.source, 4)], rows)
+        self.assertEqual(rows, self.index.find_symbol('setup_logging'))
+        self.assertEqual([1, 4, 5],
+                         [row[-1] for row in self.index.find_module(
+                             'neutron/common/config.py')])
+        self.assertEqual(5, len(self.index.find_source(self.source)))
+        self.assertEqual(5, len(self.index.find_source('source.py')))
+
+    def test_source_suffix_matched_literally(self):
+        for name in ('db_api.py', 'dbXapi.py'):
+            shutil.copy(self.source, os.path.join(self.root, name))
+            path = os.path.join(self.root, name)
+            _, modules = scanner.scan_source_file(path)
+            self.index.update_file(path, modules)
+        rows = self.index.find_source('db_api.py')
+        self.assertEqual(set([os.path.join(self.root, 'db_api.py')]),
+                         set(row[-2] for row in rows))
+        self.assertEqual([], self.index.find_source('db%.py'))
+
+    def test_rescanned_and_removed_files_replaced(self):
+        _, modules = scanner.scan_source_file(self.source)
+        self.index.update_file(self.source, modules)
+        self.index.update_file(self.source, modules)
+        self.assertEqual(5, len(self.index.find_source(self.source)))
+        self.index.remove_missing(self.root, [])
+        self.assertEqual([], self.index.find_source(self.source))
+
+
+class TestSummary(base.BaseTestCase):
+
+    def test_summary_jsonl(self):
+        modules = {
+            'neutron.i18n': scanner.NeutronModule.from_report(
+                'neutron.i18n', 'neutron/i18n.py', ['_LW', '_LE']),
+            'neutron.agent': scanner.NeutronModule.from_report(
+                'neutron.agent', 'neutron/agent', []),
+        }
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        filename = os.path.join(root, 'refs.summary.jsonl')
+        scanner.write_summary_jsonl(modules, filename)
+        with open(filename) as f:
+            records = [json.loads(line) for line in f]
+        self.assertEqual([{'module': 'neutron/agent',
+                           'dotted_name': 'neutron.agent',
+                           'refs': []},
+                          {'module': 'neutron/i18n.py',
+                           'dotted_name': 'neutron.i18n',
+                           'refs': ['_LE', '_LW']}], records)
+
+    def test_summary_for_each_root(self):
+        def modules(*refs):
+            return {'neutron.i18n': scanner.NeutronModule.from_report(
+                'neutron.i18n', 'neutron/i18n.py', refs)}
+
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        output = os.path.join(root, 'refs')
+        roots = ['/src/vpnaas', '/src/fwaas/', '/other/vpnaas']
+        args = scanner.create_parser().parse_args(['-s', '-o', output] +
+                                                  roots)
+        summary = scanner.Summary(args.roots)
+        summary.add('/src/vpnaas/a.py', modules('_LE'))
+        summary.add('/src/fwaas/b.py', modules('_LI'))
+        summary.add('/other/vpnaas/c.py', modules('_LW'))
+        summary.add('/src/vpnaas/d.py', modules('_LI'))
+        summary.write(args, None)
+        expected = {'refs': ['_LE', '_LI', '_LW'],
+                    'refs-vpnaas': ['_LE', '_LI'],
+                    'refs-fwaas': ['_LI'],
+                    'refs-vpnaas-2': ['_LW']}
+        for name, refs in expected.items():
+            with open(os.path.join(root, name + '.summary.jsonl')) as f:
+                self.assertEqual(refs, json.loads(f.read())['refs'])
+        with open(os.path.join(root, 'refs-fwaas.summary')) as f:
+            self.assertEqual("Summary of neutron import usage in /src/fwaas/\n"
+                             "    neutron/i18n.py\n"
+                             "        _LI\n", f.read())
+
+    def test_counted_summary_removes_files(self):
+        def modules(*refs):
+            return {'neutron.i18n': scanner.NeutronModule.from_report(
+                'neutron.i18n', 'neutron/i18n.py', refs)}
+
+        summary = scanner.Summary(['/src/vpnaas', '/src/fwaas'],
+                                  counted=True)
+        summary.add('/src/vpnaas/a.py', modules('_LE', '_LI'))
+        summary.add('/src/fwaas/b.py', modules('_LI'))
+        summary.remove('/src/vpnaas/a.py', modules('_LE', '_LI'))
+        self.assertEqual(set(['_LI']),
+                         summary.all_references['neutron.i18n'].refs)
+        self.assertEqual({}, summary.root_references['/src/vpnaas'])
+        summary.remove('/src/fwaas/b.py', modules('_LI'))
+        self.assertEqual({}, summary.all_references)
+        self.assertFalse(summary.counts)
+
+
+class TestFootprint(base.BaseTestCase):
+
+    def setUp(self):
+        super(TestFootprint, self).setUp()
+        self.addCleanup(scanner.set_targets, list(scanner.targets.items()))
+        self.base = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.base)
+        sources = {
+            'neutron/__init__.py': "",
+            'neutron/common/__init__.py': "",
+            'neutron/common/constants.py': "X = 1\n",
+            'neutron/common/rpc.py': ("from neutron.common import utils\n"
+                                      "utils.g()\n"),
+            'neutron/common/utils.py': ("from neutron.common import rpc\n"
+                                        "from neutron.common import "
+                                        "constants\n"
+                                        "rpc.f(constants.X)\n"),
+        }
+        for name, source in sources.items():
+            path = os.path.join(self.base, name)
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with open(path, 'w') as f:
+                f.write(source)
+        scanner.set_targets([('neutron', self.base)])
+
+    def test_closure_of_circular_imports(self):
+        graph = scanner.DependencyGraph()
+        self.assertEqual(set(['neutron/common/rpc.py',
+                              'neutron/common/utils.py',
+                              'neutron/common/constants.py']),
+                         graph.closure('neutron/common/rpc.py'))
+        self.assertEqual(set(), graph.closure('neutron/common/constants.py'))
+        modules = graph.footprint(['neutron/common'])
+        self.assertEqual(set(['neutron/common']), modules)
+        fan_in = graph.fan_in(graph.footprint(['neutron/common/utils.py']))
+        self.assertEqual(1, fan_in['neutron/common/constants.py'])
+        self.assertEqual(1, fan_in['neutron/common/rpc.py'])
+
+    def test_modules_scanned_once(self):
+        scanned = []
+
+        def scan(filenames):
+            scanned.extend(filenames)
+            return scanner.gen_scan(filenames)
+
+        graph = scanner.DependencyGraph(scan)
+        graph.footprint(['neutron/common/rpc.py'])
+        graph.footprint(['neutron/common/utils.py',
+                         'neutron/common/constants.py'])
+        self.assertEqual(3, len(scanned))
+        self.assertEqual(len(scanned), len(set(scanned)))
+
+    def test_closures_of_components(self):
+        graph = scanner.DependencyGraph()
+        graph.imports = {'a': frozenset(['b']), 'b': frozenset(['c', 'd']),
+                         'c': frozenset(['a']), 'd': frozenset(['e']),
+                         'e': frozenset()}
+        self.assertEqual(set('abcde'), graph.closure('b'))
+        self.assertEqual(set('e'), graph.closure('d'))
+        self.assertIs(graph.closures['a'], graph.closures['c'])
+
+
+class TestMemoryUse(base.BaseTestCase):
+
+    def test_references_interned(self):
+        first = scanner.NeutronModule.from_report(
+            'neutron.i18n', 'neutron/i18n.py', [''.join(['_', 'LE'])])
+        second = scanner.NeutronModule('neutron.i18n')
+        second.add_usage(''.join(['_', 'LE']))
+        self.assertIs(list(first.refs)[0], list(second.refs)[0])
+        self.assertRaises(AttributeError, setattr, first, 'other', 1)
+
+    def test_package_names_interned(self):
+        module = scanner.NeutronModule('.'.join(['neutron', 'common']))
+        self.assertEqual('neutron/common', module.name)
+        self.assertIs(scanner.intern('neutron/common'), module.name)
+        self.assertIs(scanner.intern('neutron.common'), module.dotted_name)
+
+    def test_usage_regex_cache_bounded(self):
+        mock.patch.object(scanner, 'usage_regex_cache', {}).start()
+        mock.patch.object(scanner, 'USAGE_REGEX_CACHE_SIZE', 3).start()
+        for i in range(5):
+            scanner.ImportAlias.make_combined_usage_regex(['a%d' % i, 'b'])
+        self.assertEqual(2, len(scanner.usage_regex_cache))
+
+    def test_spilled_results(self):
+        results = scanner.SpilledResults()
+        self.addCleanup(results.close)
+        results['a.py'] = {'neutron.i18n': scanner.NeutronModule.from_report(
+            'neutron.i18n', 'neutron/i18n.py', ['_LE', '_LW'])}
+        results['b.py'] = {}
+        self.assertEqual(set(['_LE', '_LW']),
+                         results['a.py']['neutron.i18n'].refs)
+        self.assertEqual(['a.py', 'b.py'],
+                         sorted(name for name, modules in results.items()))
+        self.assertEqual({}, results.pop('b.py'))
+        self.assertIsNone(results.pop('b.py'))
+        self.assertEqual(['a.py'], [name for name, _ in results.items()])
+
+
 class TestMiscellaneous(base.BaseTestCase):
 
     def test_exception(self):
@@ -260,3 +1033,19 @@ class TestMiscellaneous(base.BaseTestCase):
                              e.msg)
         else:
             self.fail("Expected exception did not occur")
+
+    def test_exception_from_worker_process(self):
+        e = pickle.loads(pickle.dumps(scanner.NeutronModuleNotFound(
+            name="foo")))
+        self.assertIsInstance(e, scanner.NeutronModuleNotFound)
+        self.assertEqual("Unable to find Neutron module 'foo'", e.msg)
+
+    def test_jobs_option(self):
+        parser = scanner.create_parser()
+        self.assertEqual(1, parser.parse_args(['src']).jobs)
+        self.assertEqual(4, parser.parse_args(['-j', '4', 'src']).jobs)
+        self.assertEqual(0, parser.parse_args(['src', '-j']).jobs)
+        for value in ('0', '-1', 'x'):
+            with mock.patch('sys.stderr'):
+                self.assertRaises(SystemExit, parser.parse_args,
+                                  ['-j', value, 'src'])
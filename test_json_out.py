@@ -0,0 +1,332 @@
+import csv
+import gzip
+import imp
+import json
+import optparse
+import os
+import shutil
+import StringIO
+import sys
+import tempfile
+import threading
+import unittest
+
+import mock
+
+TOOLS_DIR = os.path.dirname(os.path.abspath(__file__))
+json_out = imp.load_source('json_out', os.path.join(TOOLS_DIR, 'json-out.py'))
+stub = imp.load_source('neutron_stub',
+                       os.path.join(TOOLS_DIR, 'neutron-stub.py'))
+
+
+# NOTE: json-out.py is Python 2 only. These also test neutron-stub.py.
+# Run the tests with:
+#    python2 -m unittest test_json_out
+
+class BaseTestCase(unittest.TestCase):
+
+    def setUp(self):
+        super(BaseTestCase, self).setUp()
+        opts = optparse.Values({'show_all_headers': False,
+                                'show_auth': False,
+                                'show_debug_output': False,
+                                'show_output': False})
+        patcher = mock.patch.object(json_out, 'opts', opts, create=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+
+
+class TestBatch(BaseTestCase):
+
+    def setUp(self):
+        super(TestBatch, self).setUp()
+        # Output files are named by the (relative) prefixes
+        self.addCleanup(os.chdir, os.getcwd())
+        os.chdir(self.root)
+
+    def write_manifest(self, content):
+        name = os.path.join(self.root, 'manifest')
+        with open(name, 'w') as f:
+            f.write(content)
+        return name
+
+    def test_job_that_raises_fails_without_hanging(self):
+        job = json_out.BatchJob(os.path.join(self.root, 'one'), [], ['x'])
+        with mock.patch.object(json_out, 'process_command',
+                               side_effect=KeyError('Accept')):
+            batch = threading.Thread(target=json_out.run_batch,
+                                     args=([job], 2))
+            batch.daemon = True
+            batch.start()
+            batch.join(10)
+        self.assertFalse(batch.is_alive())
+        self.assertEqual("failed (KeyError: 'Accept')", job.status)
+
+    def test_circular_dependency_rejected_when_read(self):
+        manifest = self.write_manifest("first -- true\n"
+                                       "b c -- true\n"
+                                       "c b -- true\n")
+        with self.assertRaises(json_out.InvalidManifestException) as e:
+            json_out.read_manifest(manifest)
+        self.assertEqual("Circular dependency among: b, c",
+                         str(e.exception))
+
+    def test_manifest_without_commands_rejected(self):
+        manifest = self.write_manifest("# Nothing to run yet\n\n")
+        with self.assertRaises(json_out.InvalidManifestException) as e:
+            json_out.read_manifest(manifest)
+        self.assertEqual("No commands found", str(e.exception))
+
+    def test_skipped_job_allows_earlier_job_to_be_skipped(self):
+        manifest = self.write_manifest("later after -- true\n"
+                                       "after first -- true\n"
+                                       "first -- false\n")
+        jobs = json_out.read_manifest(manifest)
+        with mock.patch.object(json_out, 'process_command',
+                               side_effect=[(['ERROR: x'], 0)]):
+            json_out.run_batch(jobs, 2)
+        self.assertEqual(['skipped (after failed)', 'skipped (first failed)',
+                          'failed'], [job.status for job in jobs])
+
+
+class TestReplay(BaseTestCase):
+
+    def test_unexpected_failure_counted_without_latency(self):
+        stats = json_out.ApiStats()
+        request = ('GET', 'http://127.0.0.1:9696/v2.0/routers.json', {}, None)
+        replayer = json_out.Replayer('http://127.0.0.1:9696', [request], 4,
+                                     stats)
+        with mock.patch.object(json_out.Replayer, 'send',
+                               side_effect=[('200', '{}'),
+                                            RuntimeError('boom'),
+                                            ('200', '{}'), ('200', '{}')]):
+            replayer.run(1)
+        self.assertEqual(3, len(replayer.latencies))
+        self.assertEqual({'RuntimeError: boom': 1}, dict(replayer.failures))
+        endpoint, = stats.summary()
+        self.assertEqual(4, endpoint['count'])
+        self.assertEqual(1, endpoint['errors'])
+
+
+class TestExchangeParsing(BaseTestCase):
+
+    def log(self, request_id, message):
+        return ("2015-01-01 12:00:00.000 111 DEBUG neutronclient.client "
+                "[%s u t] %s\n" % (request_id, message))
+
+    def test_request_ids_in_one_process_correlated(self):
+        req_a = 'req-aaaa-0001'
+        req_b = 'req-bbbb-0002'
+        text = ''.join([
+            self.log(req_a, 'REQ: curl -i -X GET '
+                     'http://h:9696/v2.0/routers.json -H "Accept: x"'),
+            self.log(req_b, 'REQ: curl -i -X GET '
+                     'http://h:9696/v2.0/networks.json -H "Accept: x"'),
+            self.log(req_b, 'RESP: [200] {}'),
+            self.log(req_b, 'RESP BODY: {"networks": []}'),
+            self.log(req_a, 'RESP: [200] {}'),
+            self.log(req_a, 'RESP BODY: {"routers": []}')])
+        exchanges = list(json_out.parse_exchanges(text))
+        self.assertEqual(2, len(exchanges))
+        for exchange in exchanges:
+            self.assertIn('/v2.0/networks.json' if 'networks' in exchange.body
+                          else '/v2.0/routers.json', exchange.request)
+
+    def test_request_without_standard_headers_printed(self):
+        exchange = json_out.Exchange(
+            'REQ: curl -i -X GET http://h:9696/v2.0/routers.json '
+            '-H "X-Auth-Token: t"', ' [200] {}', ' {"routers": []}',
+            None, None)
+        with open(os.path.join(self.root, 'out'), 'w') as output_file:
+            self.assertEqual(1, json_out.print_info_from_req_resp(
+                [exchange], output_file))
+
+    def test_unparsable_request_not_replayed(self):
+        good = json_out.Exchange(
+            'REQ: curl -i -X GET http://h:9696/v2.0/routers.json '
+            '-H "Accept: x"', None, None, None, None)
+        bad = json_out.Exchange('REQ: garbled', None, None, None, None)
+        with mock.patch('sys.stderr'):
+            requests = list(json_out.gen_captured_requests([bad, good]))
+        self.assertEqual([('GET', 'http://h:9696/v2.0/routers.json',
+                           {'Accept': 'x'}, None)], requests)
+
+
+class TestStreaming(BaseTestCase):
+
+    def test_debug_output_streamed_while_stdout_drained(self):
+        flag = os.path.join(self.root, 'flag')
+        # The command waits for the first line to be read (or times out),
+        # then writes more stdout than a pipe holds
+        script = ("import os, sys, time\n"
+                  "sys.stderr.write('first\\n')\n"
+                  "sys.stderr.flush()\n"
+                  "for _ in range(1000):\n"
+                  "    if os.path.exists(%r):\n"
+                  "        break\n"
+                  "    time.sleep(0.01)\n"
+                  "else:\n"
+                  "    sys.stderr.write('timed out\\n')\n"
+                  "for i in range(3):\n"
+                  "    sys.stdout.write('x' * 100000 + '\\n')\n"
+                  "    sys.stderr.write('line %%d\\n' %% i)\n" % flag)
+        output = []
+        lines = json_out.stream_output_from_command(
+            [sys.executable, '-c', script], output)
+        self.assertEqual('first\n', next(lines))
+        open(flag, 'w').close()
+        self.assertEqual(['line 0\n', 'line 1\n', 'line 2\n'], list(lines))
+        self.assertEqual(3 * 100001, len(''.join(output)))
+
+
+class TestLogs(BaseTestCase):
+
+    log = ('REQ: curl -i -X GET http://h:9696/v2.0/routers.json '
+           '-H "Accept: x"\n'
+           'RESP: [200] {}\n'
+           'RESP BODY: {"routers": []}\n')
+
+    def test_chunks_end_with_complete_lines(self):
+        name = os.path.join(self.root, 'neutron.log')
+        with open(name, 'w') as f:
+            f.write(self.log * 3)
+        chunks = list(json_out.gen_output_from_file(name, chunk_size=50))
+        self.assertTrue(all(chunk.endswith('\n') for chunk in chunks))
+        self.assertEqual(self.log * 3, ''.join(chunks))
+
+    def test_exchange_split_across_chunks(self):
+        name = os.path.join(self.root, 'neutron.log')
+        with open(name, 'w') as f:
+            f.write(self.log * 2)
+        reader = json_out.gen_output_from_file
+        with mock.patch.object(json_out, 'gen_output_from_file',
+                               side_effect=lambda f: reader(f, 40)), \
+                mock.patch('sys.stderr'):
+            exchanges = list(json_out.gen_requests_and_responses_from_logs(
+                [name]))
+        self.assertEqual(2, len(exchanges))
+        for exchange in exchanges:
+            self.assertIn('/v2.0/routers.json', exchange.request)
+            self.assertEqual(' {"routers": []}', exchange.body)
+
+    def test_gzipped_log(self):
+        name = os.path.join(self.root, 'neutron.log.gz')
+        f = gzip.open(name, 'wb')
+        f.write(self.log)
+        f.close()
+        with mock.patch('sys.stderr'):
+            exchanges = list(json_out.gen_requests_and_responses_from_logs(
+                [name]))
+        self.assertEqual(1, len(exchanges))
+        self.assertEqual(' [200] {}', exchanges[0].response)
+
+
+class TestApiStats(BaseTestCase):
+
+    def test_url_template_replaces_ids(self):
+        self.assertEqual(
+            '/v2.0/routers/{id}.json', json_out.url_template(
+                'http://h:9696/v2.0/routers/'
+                '6bed56d5-4fad-4a5e-801c-22c06cac64db.json?fields=id'))
+        self.assertEqual(
+            '/v2.0/tenants/{id}/quotas/{id}', json_out.url_template(
+                'http://h:9696/v2.0/tenants/f600e82d8b324979bb412d5e655cf0ee'
+                '/quotas/42'))
+        self.assertEqual('/v2.0/routers.json', json_out.url_template(
+            'http://h:9696/v2.0/routers.json'))
+
+    def stats(self):
+        stats = json_out.ApiStats()
+        for i in range(1, 11):
+            stats.add('GET', 'http://h/v2.0/routers/%d.json' % i,
+                      '500' if i == 10 else '200', i / 1000.0, 0, 100 * i)
+        stats.add('POST', 'http://h/v2.0/routers.json', None, None, 30, 0)
+        return stats
+
+    def test_summary_percentiles(self):
+        post, get = self.stats().summary()
+        self.assertEqual(('GET', '/v2.0/routers/{id}.json', 10, 1),
+                         (get['method'], get['url'], get['count'],
+                          get['errors']))
+        expected = {'mean': 5.5, 'p50': 5, 'p90': 9, 'p99': 10, 'max': 10}
+        for name, value in expected.items():
+            self.assertAlmostEqual(value, get['latency_ms'][name])
+        self.assertEqual({'mean': 550, 'max': 1000}, get['response_bytes'])
+        self.assertEqual(1, post['errors'])
+        self.assertIsNone(post['latency_ms'])
+
+    def test_report_as_json_or_csv(self):
+        endpoints = self.stats().summary()
+        name = os.path.join(self.root, 'report.json')
+        json_out.write_api_report(endpoints, name)
+        with open(name) as f:
+            self.assertEqual(json.loads(json.dumps(endpoints)), json.load(f))
+        name = os.path.join(self.root, 'report.csv')
+        json_out.write_api_report(endpoints, name)
+        with open(name) as f:
+            rows = list(csv.reader(f))
+        self.assertEqual(['method', 'url', 'count', 'errors',
+                          'latency_mean_ms', 'latency_p50_ms',
+                          'latency_p90_ms', 'latency_p99_ms',
+                          'latency_max_ms', 'request_bytes_mean',
+                          'request_bytes_max', 'response_bytes_mean',
+                          'response_bytes_max'], rows[0])
+        self.assertEqual(['POST', '/v2.0/routers.json', '1', '1',
+                          '', '', '', '', '', '30', '30', '0', '0'], rows[1])
+        self.assertEqual(['GET', '/v2.0/routers/{id}.json', '10', '1'],
+                         rows[2][:4])
+
+
+class TestStubServer(BaseTestCase):
+
+    def setUp(self):
+        super(TestStubServer, self).setUp()
+        self.server = stub.create_server('127.0.0.1', 0, records=1, size=10)
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.client = stub.StubClient(
+            'http://127.0.0.1:%d' % self.server.server_address[1], 'token',
+            verbose=True)
+
+    def run_command(self, resource, action, target, fields=None):
+        """Run client command, returning its debug and normal output."""
+        debug_output = StringIO.StringIO()
+        output = StringIO.StringIO()
+        with mock.patch('sys.stderr', debug_output):
+            stub.run_command(self.client, resource, action, target,
+                             fields or {}, output)
+        return debug_output.getvalue(), output.getvalue()
+
+    def test_create_and_show_parsed_by_json_out(self):
+        debug_output, output = self.run_command(
+            'vpn-ikepolicy', 'create', 'ike1', {'pfs': 'group14'})
+        self.assertIn('Created a new ikepolicy:', output)
+        debug_output += self.run_command('vpn-ikepolicy', 'show', 'ike1')[0]
+        create, lookup, show = json_out.parse_exchanges(debug_output)
+        self.assertIn('-X POST', create.request)
+        self.assertIn(' [201] ', create.response)
+        created = json.loads(create.body)['ikepolicy']
+        self.assertEqual('group14', created['pfs'])
+        # The name lookup only asks for (and gets) the ID
+        self.assertIn('?fields=id&name=ike1', lookup.request)
+        ikepolicy_id = created['id']
+        self.assertEqual({'ikepolicies': [{'id': ikepolicy_id}]},
+                         json.loads(lookup.body))
+        self.assertIn('/v2.0/vpn/ikepolicies/%s.json' % ikepolicy_id,
+                      show.request)
+        self.assertEqual('x' * 10,
+                         json.loads(show.body)['ikepolicy']['description'])
+        with open(os.path.join(self.root, 'out'), 'w') as output_file:
+            self.assertEqual(3, json_out.print_info_from_req_resp(
+                [create, lookup, show], output_file))
+
+    def test_list_and_missing_resource(self):
+        _, output = self.run_command('router', 'list', None)
+        self.assertIn('router0', output)
+        self.assertRaises(stub.StubClientError, self.run_command,
+                          'router', 'delete', 'nosuch')